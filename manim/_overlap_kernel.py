@@ -0,0 +1,118 @@
+"""
+Native Overlap Kernel
+
+Per-frame sweep-and-prune + AABB intersection used by MobjectAnalyzer,
+with every captured frame handled in one call. JIT-compiled with Numba
+when it is installed; otherwise an equivalent NumPy broadcast is used.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+def _find_overlaps_batched_numpy(mins: np.ndarray, maxs: np.ndarray,
+                                 counts: np.ndarray, threshold: float) -> np.ndarray:
+    """Pure NumPy fallback: (T, N, N) pairwise test, padding masked out."""
+    n = mins.shape[1]
+    hits = np.all(
+        (mins[:, :, None, :] < maxs[:, None, :, :] - threshold) &
+        (maxs[:, :, None, :] > mins[:, None, :, :] + threshold),
+        axis=-1
+    )
+    valid = np.arange(n) < counts[:, None]
+    hits &= valid[:, :, None] & valid[:, None, :]
+    hits &= np.triu(np.ones((n, n), dtype=bool), k=1)
+    return np.argwhere(hits).astype(np.int64)
+
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _boxes_overlap(mins, maxs, a, b, threshold):
+        # Branchless: one bit per axis, overlap iff every bit is set
+        ndim = mins.shape[1]
+        bits = 0
+        for d in range(ndim):
+            bits |= (
+                int(mins[a, d] < maxs[b, d] - threshold) &
+                int(maxs[a, d] > mins[b, d] + threshold)
+            ) << d
+        return bits == (1 << ndim) - 1
+
+    @njit(parallel=True, cache=True)
+    def _find_overlaps_batched_numba(mins, maxs, counts, threshold):
+        n_frames = mins.shape[0]
+
+        # Each frame's real boxes ordered along x for the sweep
+        orders = np.zeros((n_frames, mins.shape[1]), dtype=np.int64)
+
+        # Pass 1: sort and count hits per frame, frames in parallel
+        frame_hits = np.zeros(n_frames, dtype=np.int64)
+        for t in prange(n_frames):
+            n = counts[t]
+            orders[t, :n] = np.argsort(mins[t, :n, 0])
+            c = 0
+            for p in range(n):
+                a = orders[t, p]
+                limit = maxs[t, a, 0] - threshold
+                q = p + 1
+                while q < n and mins[t, orders[t, q], 0] < limit:
+                    if _boxes_overlap(mins[t], maxs[t], a, orders[t, q], threshold):
+                        c += 1
+                    q += 1
+            frame_hits[t] = c
+
+        offsets = np.zeros(n_frames + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(frame_hits)
+        out = np.empty((offsets[n_frames], 3), dtype=np.int64)
+
+        # Pass 2: emit (frame, lower index, higher index) rows into each frame's slice
+        for t in prange(n_frames):
+            n = counts[t]
+            k = offsets[t]
+            for p in range(n):
+                a = orders[t, p]
+                limit = maxs[t, a, 0] - threshold
+                q = p + 1
+                while q < n and mins[t, orders[t, q], 0] < limit:
+                    b = orders[t, q]
+                    if _boxes_overlap(mins[t], maxs[t], a, b, threshold):
+                        out[k, 0] = t
+                        out[k, 1] = min(a, b)
+                        out[k, 2] = max(a, b)
+                        k += 1
+                    q += 1
+
+        return out
+
+
+def find_overlaps_batched(mins: np.ndarray, maxs: np.ndarray, counts: np.ndarray,
+                          threshold: float = 0.1) -> np.ndarray:
+    """
+    Find overlapping box pairs in every frame at once.
+    
+    Args:
+        mins: (T, N, D) array of per-box minimum coordinates, padded per frame
+        maxs: (T, N, D) array of per-box maximum coordinates, padded per frame
+        counts: (T,) number of real boxes in each frame; the rest is padding
+        threshold: Edge tolerance, same as BoundingBox.overlaps_with
+        
+    Returns:
+        (K, 3) int64 array of (frame, i, j) rows with i < j, sorted
+    """
+    mins = np.ascontiguousarray(mins, dtype=np.float64)
+    maxs = np.ascontiguousarray(maxs, dtype=np.float64)
+    counts = np.ascontiguousarray(counts, dtype=np.int64)
+    
+    if mins.shape[0] == 0 or mins.shape[1] < 2:
+        return np.empty((0, 3), dtype=np.int64)
+    
+    if HAS_NUMBA:
+        rows = _find_overlaps_batched_numba(mins, maxs, counts, threshold)
+        return rows[np.lexsort((rows[:, 2], rows[:, 1], rows[:, 0]))]
+    
+    return _find_overlaps_batched_numpy(mins, maxs, counts, threshold)
@@ -15,6 +15,11 @@ from typing import List, Dict, Tuple, Optional
 from dataclasses import dataclass
 
 
+# Per-line checks, compiled once at import
+_FONT_SIZE_RE = re.compile(r'font_size\s*=\s*(\d+)')
+_WAIT_RE = re.compile(r'self\.wait\((\d+(?:\.\d+)?)\)')
+
+
 @dataclass
 class CodeIssue:
     """Represents a detected issue in the code."""
@@ -103,7 +108,7 @@ class ManimCodeAnalyzer:
         for line_num, line in enumerate(self.lines, 1):
             # Look for font_size parameter
             if 'font_size' in line:
-                match = re.search(r'font_size\s*=\s*(\d+)', line)
+                match = _FONT_SIZE_RE.search(line)
                 if match:
                     size = int(match.group(1))
                     
@@ -128,7 +133,7 @@ class ManimCodeAnalyzer:
         """Check for wait times that might be too short or too long."""
         for line_num, line in enumerate(self.lines, 1):
             if 'self.wait(' in line:
-                match = re.search(r'self\.wait\((\d+(?:\.\d+)?)\)', line)
+                match = _WAIT_RE.search(line)
                 if match:
                     wait_time = float(match.group(1))
                     
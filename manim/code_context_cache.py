@@ -0,0 +1,90 @@
+"""
+Gemini Code Context Cache
+
+Uploads the starting script to Gemini's context cache once, so later
+improvement prompts carry a unified diff against it instead of the whole file.
+"""
+
+import datetime
+import difflib
+from typing import Optional, Tuple
+
+import google.generativeai as genai
+from google.generativeai import caching
+
+
+class CodeContextCache:
+    """Holds the base script in a Gemini CachedContent for the length of a run."""
+
+    # Long enough to outlive a full improvement run; released explicitly at the end
+    TTL = datetime.timedelta(minutes=30)
+
+    def __init__(self, model_name: str):
+        """
+        Initialize the code context cache.
+
+        Args:
+            model_name: Gemini model the cache is created for
+        """
+        self.model_name = model_name
+        self.base_code: Optional[str] = None
+        self._cache = None
+        self._model = None
+        self._unavailable = False
+
+    def prepare(self, current_code: str, fallback_model) -> Tuple[object, str]:
+        """
+        Get the model to call and the code text to put in the prompt.
+
+        The first call caches current_code as the base. If caching is not
+        possible (e.g. the script is below the API's minimum cache size),
+        the fallback model and the full code are returned from then on.
+
+        Args:
+            current_code: Current Manim script code
+            fallback_model: Model to use without a cache
+
+        Returns:
+            Tuple of (model, code text for the prompt)
+        """
+        if self._cache is None and not self._unavailable:
+            try:
+                self._cache = caching.CachedContent.create(
+                    model=f"models/{self.model_name}",
+                    contents=[f"BASE MANIM CODE:\n```python\n{current_code}\n```"],
+                    ttl=self.TTL
+                )
+                self._model = genai.GenerativeModel.from_cached_content(self._cache)
+                self.base_code = current_code
+                print("  ✓ Base code cached in Gemini context")
+            except Exception as e:
+                self._unavailable = True
+                print(f"  ℹ️  Context caching unavailable, sending full code: {e}")
+
+        if self._cache is None:
+            return fallback_model, current_code
+
+        return self._model, self._describe_changes(current_code)
+
+    def _describe_changes(self, current_code: str) -> str:
+        """Express current_code as a unified diff against the cached base."""
+        diff = "".join(difflib.unified_diff(
+            self.base_code.splitlines(keepends=True),
+            current_code.splitlines(keepends=True),
+            fromfile="base.py",
+            tofile="current.py"
+        ))
+        if not diff:
+            return "# Identical to the BASE MANIM CODE in context"
+        return "# The BASE MANIM CODE in context with this unified diff applied:\n" + diff
+
+    def release(self):
+        """Delete the cached content, if any."""
+        if self._cache is None:
+            return
+        try:
+            self._cache.delete()
+        except Exception as e:
+            print(f"  Warning: Could not delete Gemini context cache: {e}")
+        self._cache = None
+        self._model = None
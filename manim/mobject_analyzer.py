@@ -10,6 +10,8 @@ from typing import List, Dict, Tuple, Optional
 from dataclasses import dataclass
 import json
 
+from _overlap_kernel import find_overlaps_batched
+
 
 @dataclass
 class BoundingBox:
@@ -63,6 +65,25 @@ class OverlapIssue:
     suggestion: str
 
 
+def overlap_percentages_for_pairs(mins: np.ndarray, maxs: np.ndarray,
+                                  pairs: np.ndarray) -> np.ndarray:
+    """
+    Percentage of box i covered by box j for each (i, j) in pairs.
+    
+    Args:
+        mins: (N, 2) array of (x_min, y_min) per box
+        maxs: (N, 2) array of (x_max, y_max) per box
+        pairs: (K, 2) array of overlapping box indices
+        
+    Returns:
+        (K,) array of overlap percentages
+    """
+    a, b = pairs[:, 0], pairs[:, 1]
+    extent = np.minimum(maxs[a], maxs[b]) - np.maximum(mins[a], mins[b])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.prod(extent, axis=-1) / np.prod(maxs[a] - mins[a], axis=-1) * 100
+
+
 class MobjectAnalyzer:
     """Analyzes mobjects in a Manim scene for overlaps."""
     
@@ -70,6 +91,8 @@ class MobjectAnalyzer:
         self.bounding_boxes: List[BoundingBox] = []
         self.overlap_issues: List[OverlapIssue] = []
         self.current_timestamp = 0.0
+        # (timestamp, boxes) per capture, analyzed together by analyze_captures()
+        self._capture_log: List[Tuple[float, List[BoundingBox]]] = []
     
     def get_bounding_box(self, mobject, name: str = None) -> BoundingBox:
         """
@@ -122,26 +145,12 @@ class MobjectAnalyzer:
             print(f"Warning: Could not get bounding box for {name}: {e}")
             return None
     
-    def analyze_scene_mobjects(self, scene, timestamp: float = 0.0) -> List[OverlapIssue]:
-        """
-        Analyze all mobjects in a scene for overlaps.
-        
-        Args:
-            scene: Manim Scene object
-            timestamp: Current animation timestamp
-            
-        Returns:
-            List of detected overlap issues
-        """
-        self.current_timestamp = timestamp
-        self.bounding_boxes = []
-        issues = []
-        
-        # Get all mobjects currently in the scene
-        mobjects = scene.mobjects
+    def _extract_bounding_boxes(self, scene) -> List[BoundingBox]:
+        """Collect bounding boxes for all visible mobjects in a scene."""
+        boxes = []
         
         # Extract bounding boxes for all visible mobjects
-        for i, mob in enumerate(mobjects):
+        for i, mob in enumerate(scene.mobjects):
             # Skip if mobject is not visible or has no points
             try:
                 if hasattr(mob, 'get_opacity') and mob.get_opacity() == 0:
@@ -151,39 +160,104 @@ class MobjectAnalyzer:
                 bbox = self.get_bounding_box(mob, name)
                 
                 if bbox and bbox.area() > 0.01:  # Ignore very small objects
-                    self.bounding_boxes.append(bbox)
+                    boxes.append(bbox)
             except Exception as e:
                 continue
         
-        # Check for overlaps between all pairs of bounding boxes
-        for i, bbox1 in enumerate(self.bounding_boxes):
-            for j, bbox2 in enumerate(self.bounding_boxes[i+1:], i+1):
-                overlap_pct = bbox1.overlap_percentage(bbox2)
-                
-                if overlap_pct > 5:  # More than 5% overlap
-                    # Determine severity
-                    if overlap_pct > 50:
-                        severity = 'critical'
-                    elif overlap_pct > 20:
-                        severity = 'warning'
-                    else:
-                        severity = 'minor'
-                    
-                    # Generate suggestion
-                    suggestion = self._generate_suggestion(bbox1, bbox2, overlap_pct)
-                    
-                    issue = OverlapIssue(
-                        mobject1=bbox1.mobject_name,
-                        mobject2=bbox2.mobject_name,
-                        overlap_percentage=overlap_pct,
-                        severity=severity,
-                        timestamp=timestamp,
-                        suggestion=suggestion
-                    )
-                    issues.append(issue)
+        return boxes
+    
+    def capture_scene_mobjects(self, scene, timestamp: float = 0.0) -> int:
+        """
+        Record mobject bounding boxes without running overlap detection.
+        
+        Captures are analyzed together by analyze_captures().
+        
+        Args:
+            scene: Manim Scene object
+            timestamp: Current animation timestamp
+            
+        Returns:
+            Number of bounding boxes recorded
+        """
+        self.current_timestamp = timestamp
+        self.bounding_boxes = self._extract_bounding_boxes(scene)
+        self._capture_log.append((timestamp, self.bounding_boxes))
+        return len(self.bounding_boxes)
+    
+    def analyze_captures(self) -> List[List[OverlapIssue]]:
+        """
+        Detect overlaps across all recorded captures in a single batch.
         
-        self.overlap_issues.extend(issues)
-        return issues
+        Returns:
+            List of overlap issues for each capture, in capture order
+        """
+        captures = self._capture_log
+        self._capture_log = []
+        if not captures:
+            return []
+        
+        # Pad every capture to (T, N, 2); counts mark the real boxes
+        n_boxes = max(len(boxes) for _, boxes in captures)
+        mins = np.zeros((len(captures), n_boxes, 2))
+        maxs = np.zeros((len(captures), n_boxes, 2))
+        counts = np.array([len(boxes) for _, boxes in captures])
+        for t, (_, boxes) in enumerate(captures):
+            for i, bbox in enumerate(boxes):
+                mins[t, i] = (bbox.x_min, bbox.y_min)
+                maxs[t, i] = (bbox.x_max, bbox.y_max)
+        
+        # All frames in one kernel call (parallel over frames under Numba)
+        frame_pairs = find_overlaps_batched(mins, maxs, counts)
+        frames = frame_pairs[:, 0]
+        flat_pairs = frames[:, None] * n_boxes + frame_pairs[:, 1:]
+        pcts = overlap_percentages_for_pairs(
+            mins.reshape(-1, 2), maxs.reshape(-1, 2), flat_pairs
+        )
+        hits = zip(frames, frame_pairs[:, 1], frame_pairs[:, 2], pcts)
+        
+        issues_per_capture: List[List[OverlapIssue]] = [[] for _ in captures]
+        for t, i, j, overlap_pct in hits:
+            overlap_pct = float(overlap_pct)
+            if overlap_pct <= 5:  # More than 5% overlap
+                continue
+            
+            timestamp, boxes = captures[t]
+            bbox1, bbox2 = boxes[i], boxes[j]
+            
+            # Determine severity
+            if overlap_pct > 50:
+                severity = 'critical'
+            elif overlap_pct > 20:
+                severity = 'warning'
+            else:
+                severity = 'minor'
+            
+            issues_per_capture[t].append(OverlapIssue(
+                mobject1=bbox1.mobject_name,
+                mobject2=bbox2.mobject_name,
+                overlap_percentage=overlap_pct,
+                severity=severity,
+                timestamp=timestamp,
+                suggestion=self._generate_suggestion(bbox1, bbox2, overlap_pct)
+            ))
+        
+        for issues in issues_per_capture:
+            self.overlap_issues.extend(issues)
+        return issues_per_capture
+    
+    def analyze_scene_mobjects(self, scene, timestamp: float = 0.0) -> List[OverlapIssue]:
+        """
+        Analyze all mobjects in a scene for overlaps.
+        
+        Args:
+            scene: Manim Scene object
+            timestamp: Current animation timestamp
+            
+        Returns:
+            List of detected overlap issues
+        """
+        self.capture_scene_mobjects(scene, timestamp)
+        return self.analyze_captures()[-1]
     
     def _generate_suggestion(self, bbox1: BoundingBox, bbox2: BoundingBox, overlap_pct: float) -> str:
         """Generate a helpful suggestion for fixing the overlap."""
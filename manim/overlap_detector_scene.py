@@ -56,20 +56,24 @@ def analyze_scene_with_overlap_detection(script_path: str, scene_name: str = "In
             self._capture_mobject_state()
         
         def _capture_mobject_state(self):
-            """Capture current mobject positions and check for overlaps."""
+            """Record current mobject positions; overlaps are checked after render."""
             try:
-                issues = self.mobject_analyzer.analyze_scene_mobjects(
+                self.mobject_analyzer.capture_scene_mobjects(
                     self, 
                     timestamp=self.renderer.time
                 )
+            except Exception as e:
+                print(f"Warning: Could not capture mobject state: {e}")
+        
+        def _analyze_captured_states(self):
+            """Run overlap detection over every captured state in one batch."""
+            for issues in self.mobject_analyzer.analyze_captures():
                 if issues:
                     self.overlap_snapshots.append({
-                        'timestamp': self.renderer.time,
+                        'timestamp': issues[0].timestamp,
                         'issues': len(issues),
                         'critical': sum(1 for i in issues if i.severity == 'critical')
                     })
-            except Exception as e:
-                print(f"Warning: Could not capture mobject state: {e}")
     
     # Render the scene (without actual video output, just construct)
     try:
@@ -81,6 +85,7 @@ def analyze_scene_with_overlap_detection(script_path: str, scene_name: str = "In
         
         scene = AnalyzingScene()
         scene.render()
+        scene._analyze_captured_states()
         
         # Generate final report
         report = scene.mobject_analyzer.generate_report()
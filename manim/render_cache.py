@@ -2,19 +2,36 @@
 Intelligent Render Caching System
 
 Implements code-based asset caching to avoid redundant renders.
-Uses SHA-256 hashing of source code to detect if re-rendering is needed.
+Uses BLAKE3 (or SHA-256 when blake3 is not installed) hashing of compiled
+bytecode to detect if re-rendering is needed, so whitespace and comment-only
+edits still hit the cache.
 """
 
+import atexit
 import hashlib
 import json
-import shutil
+import threading
+import types
 from pathlib import Path
 from typing import Optional, Dict
 
+from utils import fast_copy
+
+try:
+    from blake3 import blake3 as _new_hasher
+    # Tag keeps BLAKE3 keys distinct from older SHA-256 index entries
+    _HASH_TAG = "b3"
+except ImportError:
+    _new_hasher = hashlib.sha256
+    _HASH_TAG = ""
+
 
 class RenderCache:
     """Manages cached renders based on code hashes."""
     
+    # Seconds to wait before writing out lazily-dirtied index changes
+    FLUSH_DELAY = 5.0
+    
     def __init__(self, cache_dir: str = "render_cache"):
         """
         Initialize render cache.
@@ -26,6 +43,13 @@ class RenderCache:
         self.cache_dir.mkdir(exist_ok=True)
         self.cache_file = self.cache_dir / "cache_index.json"
         self.cache_index = self._load_cache_index()
+        
+        # Orphan removals on the lookup path are batched into one write.
+        # Reentrant: guards every index change and save, some of which nest
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._flush_timer: Optional[threading.Timer] = None
+        atexit.register(self._flush_if_dirty)
     
     def _load_cache_index(self) -> Dict:
         """Load cache index from disk."""
@@ -35,13 +59,42 @@ class RenderCache:
         return {}
     
     def _save_cache_index(self):
-        """Save cache index to disk."""
-        with open(self.cache_file, 'w') as f:
-            json.dump(self.cache_index, f, indent=2)
+        """Save cache index to disk, superseding any pending debounced write."""
+        with self._lock:
+            self._cancel_flush()
+            with open(self.cache_file, 'w') as f:
+                json.dump(self.cache_index, f, indent=2)
+            self._dirty = False
+    
+    def _cancel_flush(self):
+        """Drop the pending debounced write, if any. Caller holds self._lock."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+    
+    def _mark_dirty(self):
+        """Schedule a debounced index write instead of writing immediately."""
+        with self._lock:
+            self._dirty = True
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.FLUSH_DELAY, self._flush_if_dirty)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+    
+    def _flush_if_dirty(self):
+        """Write the index if there are pending changes."""
+        with self._lock:
+            if self._dirty:
+                self._save_cache_index()
+            else:
+                self._cancel_flush()
     
     def compute_code_hash(self, code: str) -> str:
         """
-        Compute SHA-256 hash of code.
+        Compute BLAKE3 (or SHA-256) hash of code.
+        
+        Hashes the compiled bytecode rather than the source text; falls back
+        to the raw text if the code does not compile.
         
         Args:
             code: Python code as string
@@ -49,7 +102,39 @@ class RenderCache:
         Returns:
             Hexadecimal hash string
         """
-        return hashlib.sha256(code.encode('utf-8')).hexdigest()
+        h = _new_hasher()
+        try:
+            code_obj = compile(code, '<hash>', 'exec', dont_inherit=True)
+        except (SyntaxError, ValueError):
+            h.update(code.encode('utf-8'))
+        else:
+            self._hash_code_object(h, code_obj)
+        return _HASH_TAG + h.hexdigest()
+    
+    def _hash_code_object(self, h, code_obj: types.CodeType):
+        """Feed a code object and its nested class/function bodies into h."""
+        h.update(code_obj.co_code)
+        # Signature shape: def f(a, b) and def f(a, *b) share bytecode
+        h.update(repr((
+            code_obj.co_flags, code_obj.co_argcount,
+            code_obj.co_posonlyargcount, code_obj.co_kwonlyargcount
+        )).encode('utf-8'))
+        for names in (code_obj.co_names, code_obj.co_varnames,
+                      code_obj.co_freevars, code_obj.co_cellvars):
+            h.update(repr(names).encode('utf-8'))
+        for const in code_obj.co_consts:
+            if isinstance(const, types.CodeType):
+                self._hash_code_object(h, const)
+            else:
+                h.update(self._const_key(const).encode('utf-8'))
+    
+    def _const_key(self, const) -> str:
+        """repr() of a constant, with set members sorted so it doesn't depend on PYTHONHASHSEED."""
+        if isinstance(const, (frozenset, set)):
+            return f"{type(const).__name__}({{{', '.join(sorted(self._const_key(c) for c in const))}}})"
+        if isinstance(const, tuple):
+            return f"({', '.join(self._const_key(c) for c in const)},)"
+        return repr(const)
     
     def get_cached_video(self, code: str, scene_name: str) -> Optional[str]:
         """
@@ -65,15 +150,17 @@ class RenderCache:
         code_hash = self.compute_code_hash(code)
         cache_key = f"{scene_name}_{code_hash}"
         
-        if cache_key in self.cache_index:
-            cached_path = self.cache_index[cache_key]["video_path"]
-            if Path(cached_path).exists():
-                print(f"✓ Cache HIT! Using cached video: {cached_path}")
-                return cached_path
-            else:
-                # Cache entry exists but video missing - clean up
-                del self.cache_index[cache_key]
-                self._save_cache_index()
+        with self._lock:
+            entry = self.cache_index.get(cache_key)
+            if entry is not None:
+                cached_path = entry["video_path"]
+                if Path(cached_path).exists():
+                    print(f"✓ Cache HIT! Using cached video: {cached_path}")
+                    return cached_path
+                else:
+                    # Cache entry exists but video missing - clean up
+                    del self.cache_index[cache_key]
+                    self._mark_dirty()
         
         print(f"✗ Cache MISS. Need to render.")
         return None
@@ -93,44 +180,50 @@ class RenderCache:
         code_hash = self.compute_code_hash(code)
         cache_key = f"{scene_name}_{code_hash}"
         
-        # Copy video to cache directory
+        # Copy video to cache directory (reflink where supported; a hardlink
+        # would follow manim rewriting video_path on the next render)
         cached_video_path = self.cache_dir / f"{cache_key}.mp4"
-        shutil.copy2(video_path, cached_video_path)
+        fast_copy(video_path, str(cached_video_path))
         
         # Update cache index
-        self.cache_index[cache_key] = {
-            "scene_name": scene_name,
-            "code_hash": code_hash,
-            "video_path": str(cached_video_path),
-            "original_path": video_path
-        }
-        self._save_cache_index()
+        with self._lock:
+            self.cache_index[cache_key] = {
+                "scene_name": scene_name,
+                "code_hash": code_hash,
+                "video_path": str(cached_video_path),
+                "original_path": video_path
+            }
+            self._save_cache_index()
         
         print(f"✓ Video cached: {cached_video_path}")
         return str(cached_video_path)
     
     def clear_cache(self):
         """Clear all cached videos and index."""
-        for cache_entry in self.cache_index.values():
-            video_path = Path(cache_entry["video_path"])
-            if video_path.exists():
-                video_path.unlink()
-        
-        self.cache_index = {}
-        self._save_cache_index()
+        with self._lock:
+            for cache_entry in self.cache_index.values():
+                video_path = Path(cache_entry["video_path"])
+                if video_path.exists():
+                    video_path.unlink()
+            
+            self.cache_index = {}
+            self._save_cache_index()
         print("✓ Cache cleared")
     
     def get_cache_stats(self) -> Dict:
         """Get cache statistics."""
-        total_entries = len(self.cache_index)
+        with self._lock:
+            entries = list(self.cache_index.values())
+        
+        total_entries = len(entries)
         valid_entries = sum(
-            1 for entry in self.cache_index.values()
+            1 for entry in entries
             if Path(entry["video_path"]).exists()
         )
         
         total_size = sum(
             Path(entry["video_path"]).stat().st_size
-            for entry in self.cache_index.values()
+            for entry in entries
             if Path(entry["video_path"]).exists()
         )
         
@@ -1,8 +1,14 @@
 import argparse
 import os
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
 from google.api_core import exceptions
 
+# Files above this size are uploaded as parallel multipart chunks
+PARALLEL_UPLOAD_THRESHOLD = 64 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+UPLOAD_WORKERS = 8
+
 def upload_video_to_gcs(bucket_name, source_file_path, destination_blob_name=None):
     
     try:
@@ -28,14 +34,24 @@ def upload_video_to_gcs(bucket_name, source_file_path, destination_blob_name=Non
         bucket = storage_client.bucket(bucket_name)
 
         # --- 5. Create a new blob (file object) in the bucket ---
-        blob = bucket.blob(destination_blob_name)
+        blob = bucket.blob(destination_blob_name, chunk_size=UPLOAD_CHUNK_SIZE)
+        # Set explicitly so the server doesn't have to sniff the type
+        blob.content_type = "video/mp4"
 
         # --- 6. Upload the file ---
         print(f"Uploading '{source_file_path}' to 'gs://{bucket_name}/{destination_blob_name}'...")
         
-        # You can also use `upload_from_file` if you have an open file object.
-        # `upload_from_filename` is efficient for large files.
-        blob.upload_from_filename(source_file_path)
+        # Large renders go up as concurrent multipart chunks (several TCP
+        # streams); small files use a single resumable upload.
+        if os.path.getsize(source_file_path) > PARALLEL_UPLOAD_THRESHOLD:
+            transfer_manager.upload_chunks_concurrently(
+                source_file_path,
+                blob,
+                chunk_size=UPLOAD_CHUNK_SIZE,
+                max_workers=UPLOAD_WORKERS,
+            )
+        else:
+            blob.upload_from_filename(source_file_path, content_type=blob.content_type)
 
         print(f"File uploaded successfully.")
         print(f"Public URL: {blob.public_url}")
@@ -4,14 +4,118 @@ Utility functions for the video improvement system.
 
 import os
 import re
-import ast
+import sys
 import json
+import time
 import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache, wraps
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, Optional, Tuple
+from string import Formatter
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+try:
+    import orjson
+except ImportError:  # Optional: faster JSON encode/decode
+    orjson = None
 
+try:
+    from xxhash import xxh3_128_digest as _code_digest
+except ImportError:  # Optional: faster non-cryptographic hash
+    def _code_digest(data: bytes) -> bytes:
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+
+# Patterns used on every Gemini response, compiled once
+_JSON_BLOCK_RE = re.compile(r'```(?:json)?\s*(\{.*?\})\s*```', re.DOTALL)
+_CODE_BLOCK_RE = re.compile(r'```python\s*(.*?)\s*```', re.DOTALL)
+_MANIM_MARKERS_RE = re.compile(
+    r'from manim import|import manim|class IntegralExplanation|def construct\(self\)'
+)
+_JSON_DECODER = json.JSONDecoder()
+
+# Validation results keyed by (validator, code digest) rather than the code
+# itself, so remembered candidates don't pin whole scripts in memory
+_VALIDATION_CACHE_SIZE = 256
+_validation_cache: "OrderedDict[Tuple[str, bytes], Tuple[bool, Optional[str]]]" = OrderedDict()
+_validation_lock = threading.Lock()
+
+# Gemini rate-limit (429 ResourceExhausted) backoff
+GEMINI_MAX_RETRIES = 5
+GEMINI_MAX_BACKOFF = 30.0
+
+# Progress bar pieces, sliced per call instead of rebuilt
+_BAR_LENGTH = 40
+_BAR_FULL = "█" * _BAR_LENGTH
+_BAR_EMPTY = "░" * _BAR_LENGTH
+
+
+def dumps_json(obj: Any) -> bytes:
+    """Serialize obj to indented JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode('utf-8')
+
+
+def loads_json(data: bytes) -> Any:
+    """Parse JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _memoized_validation(check):
+    """Cache a validator's (is_valid, error_message) result per distinct code body."""
+    name = check.__name__
+    
+    @wraps(check)
+    def wrapper(code: str) -> Tuple[bool, Optional[str]]:
+        key = (name, _code_digest(code.encode('utf-8', 'surrogatepass')))
+        with _validation_lock:
+            if key in _validation_cache:
+                _validation_cache.move_to_end(key)
+                return _validation_cache[key]
+        
+        result = check(code)
+        
+        with _validation_lock:
+            _validation_cache[key] = result
+            if len(_validation_cache) > _VALIDATION_CACHE_SIZE:
+                _validation_cache.popitem(last=False)
+        return result
+    
+    return wrapper
+
+
+def generate_with_retry(model, *args, **kwargs):
+    """
+    Call model.generate_content, backing off only when Gemini rate-limits.
+    
+    Args:
+        model: Gemini GenerativeModel
+        *args, **kwargs: Passed through to generate_content
+        
+    Returns:
+        Gemini response
+    """
+    from google.api_core.exceptions import ResourceExhausted
+    
+    delay = 1.0
+    for attempt in range(GEMINI_MAX_RETRIES):
+        try:
+            return model.generate_content(*args, **kwargs)
+        except ResourceExhausted:
+            if attempt == GEMINI_MAX_RETRIES - 1:
+                raise
+            print(f"  Gemini rate limited, retrying in {delay:.0f}s...")
+            time.sleep(delay)
+            delay = min(delay * 2, GEMINI_MAX_BACKOFF)
+
+
+@_memoized_validation
 def validate_python_syntax(code: str) -> Tuple[bool, Optional[str]]:
     """
     Validate Python code syntax.
@@ -23,7 +127,7 @@ def validate_python_syntax(code: str) -> Tuple[bool, Optional[str]]:
         Tuple of (is_valid, error_message)
     """
     try:
-        ast.parse(code)
+        compile(code, '<validation>', 'exec', dont_inherit=True)
         return True, None
     except SyntaxError as e:
         return False, f"Syntax error at line {e.lineno}: {e.msg}"
@@ -31,6 +135,7 @@ def validate_python_syntax(code: str) -> Tuple[bool, Optional[str]]:
         return False, str(e)
 
 
+@_memoized_validation
 def validate_manim_structure(code: str) -> Tuple[bool, Optional[str]]:
     """
     Validate that code has required Manim structure.
@@ -41,16 +146,19 @@ def validate_manim_structure(code: str) -> Tuple[bool, Optional[str]]:
     Returns:
         Tuple of (is_valid, error_message)
     """
+    # Collect every required marker in one pass over the code
+    found = {m.group(0) for m in _MANIM_MARKERS_RE.finditer(code)}
+    
     # Check for required imports
-    if "from manim import" not in code and "import manim" not in code:
+    if "from manim import" not in found and "import manim" not in found:
         return False, "Missing 'from manim import *' or 'import manim'"
     
     # Check for class definition
-    if "class IntegralExplanation" not in code:
+    if "class IntegralExplanation" not in found:
         return False, "Missing 'class IntegralExplanation'"
     
     # Check for construct method
-    if "def construct(self)" not in code:
+    if "def construct(self)" not in found:
         return False, "Missing 'def construct(self)' method"
     
     return True, None
@@ -73,22 +181,21 @@ def extract_json_from_text(text: str) -> Optional[Dict]:
         pass
     
     # Try to extract from code block
-    json_pattern = r'```(?:json)?\s*(\{.*?\})\s*```'
-    match = re.search(json_pattern, text, re.DOTALL)
+    match = _JSON_BLOCK_RE.search(text)
     if match:
         try:
             return json.loads(match.group(1))
         except json.JSONDecodeError:
             pass
     
-    # Try to find JSON object in text
-    brace_pattern = r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}'
-    matches = re.finditer(brace_pattern, text, re.DOTALL)
-    for match in matches:
+    # Try to find JSON object in text, letting the decoder find where it ends
+    start = text.find('{')
+    while start != -1:
         try:
-            return json.loads(match.group(0))
+            obj, _ = _JSON_DECODER.raw_decode(text, start)
+            return obj
         except json.JSONDecodeError:
-            continue
+            start = text.find('{', start + 1)
     
     return None
 
@@ -103,19 +210,117 @@ def clean_code_from_response(text: str) -> str:
     Returns:
         Clean Python code
     """
+    # No fence at all: skip the regex entirely
+    if '```' not in text:
+        return text.strip()
+    
     # Remove markdown code blocks if present
-    code_block_pattern = r'```python\s*(.*?)\s*```'
-    match = re.search(code_block_pattern, text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
+    if '```python' in text:
+        match = _CODE_BLOCK_RE.search(text)
+        if match:
+            return match.group(1).strip()
+    
+    # Bare ``` fence without a language tag
+    start = text.find('```\n')
+    if start != -1:
+        end = text.find('```', start + 4)
+        if end != -1:
+            return text[start + 4:end].strip()
     
     # If no code block, assume entire response is code
     return text.strip()
 
 
+def link_or_copy(src: str, dst: str):
+    """
+    Hardlink src to dst, falling back to a copy (e.g. across filesystems).
+    
+    Any existing dst is replaced. The two paths share data when linked, so
+    src must not be rewritten in place afterwards.
+    
+    Args:
+        src: Existing file
+        dst: Destination path
+    """
+    dst = Path(dst)
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Cross-device (EXDEV), unsupported filesystem or no permission.
+        # Symlinks are deliberately not used: they would follow src if it
+        # is replaced later.
+        shutil.copy2(src, dst)
+
+
+def atomic_write(path: str, data: Union[str, bytes]):
+    """
+    Replace path with data so readers only ever see the old or new file.
+    
+    Writes a sibling temp file and os.replace()s it over path; a crash
+    mid-write leaves the original untouched.
+    
+    Args:
+        path: File to write
+        data: Text (written as UTF-8) or bytes
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+# Linux FICLONE ioctl (_IOW(0x94, 9, int)), supported by btrfs, XFS and bcachefs
+_FICLONE = 0x40049409
+
+
+def fast_copy(src: str, dst: str):
+    """
+    Copy src to dst as a copy-on-write reflink where the filesystem allows it.
+    
+    Unlike link_or_copy, dst never shares writes with src, so this is safe for
+    Manim's media output, which is rewritten in place on the next render.
+    Otherwise uses copy_file_range (in-kernel, offloaded by NFS/CIFS and some
+    local filesystems), then shutil.copy2, which copies via sendfile (Linux)
+    or fcopyfile (macOS).
+    
+    Args:
+        src: Existing file
+        dst: Destination path
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            import fcntl
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return
+        except OSError:
+            # EOPNOTSUPP / EXDEV / EINVAL: not a reflink-capable filesystem
+            pass
+        
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                shutil.copystat(src, dst)
+                return
+        except (OSError, AttributeError):
+            # Cross-filesystem on older kernels, or Python without copy_file_range
+            pass
+    shutil.copy2(src, dst)
+
+
 def save_iteration(
     iteration_num: int,
-    code: str,
+    code: Union[str, bytes],
     video_path: str,
     feedback: Dict,
     base_dir: str
@@ -125,8 +330,9 @@ def save_iteration(
     
     Args:
         iteration_num: Iteration number
-        code: Python code as string
-        video_path: Path to rendered video
+        code: Python code as string, or already UTF-8 encoded bytes
+        video_path: Path to rendered video (must not be overwritten later,
+            since it may be hardlinked rather than copied)
         feedback: Feedback dictionary from analysis
         base_dir: Base directory for iterations
         
@@ -139,33 +345,48 @@ def save_iteration(
     
     # Save code
     code_path = iter_dir / "test.py"
-    with open(code_path, 'w', encoding='utf-8') as f:
-        f.write(code)
+    code_path.write_bytes(code if isinstance(code, bytes) else code.encode('utf-8'))
     
-    # Copy video if it exists
+    # Link (or copy) video if it exists
     if os.path.exists(video_path):
         video_dest = iter_dir / f"video_v{iteration_num:02d}.mp4"
-        shutil.copy2(video_path, video_dest)
+        link_or_copy(video_path, video_dest)
     
     # Save feedback
     feedback_path = iter_dir / "feedback.json"
-    with open(feedback_path, 'w', encoding='utf-8') as f:
-        json.dump(feedback, f, indent=2)
+    feedback_path.write_bytes(dumps_json(feedback))
     
     # Save metadata
     metadata = {
         "iteration": iteration_num,
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
         "score": feedback.get("overall_score", 0),
         "is_satisfactory": feedback.get("is_satisfactory", False)
     }
     metadata_path = iter_dir / "metadata.json"
-    with open(metadata_path, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, indent=2)
+    metadata_path.write_bytes(dumps_json(metadata))
     
     return str(iter_dir)
 
 
+def _walk_mp4(root: str):
+    """
+    Recursively yield (path, name, mtime) for every .mp4 under root.
+    
+    Uses os.scandir so each entry's stat comes from the directory walk
+    instead of a separate lookup per file.
+    """
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _walk_mp4(entry.path)
+                elif entry.name.endswith('.mp4') and entry.is_file():
+                    yield entry.path, entry.name, entry.stat().st_mtime
+    except OSError:
+        return
+
+
 def find_rendered_video(media_dir: str, scene_name: str = "IntegralExplanation") -> Optional[str]:
     """
     Find the most recently rendered video in Manim's media directory.
@@ -177,22 +398,17 @@ def find_rendered_video(media_dir: str, scene_name: str = "IntegralExplanation")
     Returns:
         Path to video file or None if not found
     """
-    media_path = Path(media_dir)
-    
     # Manim typically outputs to media/videos/[script_name]/[quality]/[scene_name].mp4
-    # Search for any MP4 files
-    video_files = list(media_path.rglob(f"*{scene_name}*.mp4"))
-    
-    if not video_files:
-        # Try finding any MP4
-        video_files = list(media_path.rglob("*.mp4"))
+    # Track the newest scene-named MP4 and the newest MP4 overall in one walk
+    best_match = (float('-inf'), None)
+    best_any = (float('-inf'), None)
+    for path, name, mtime in _walk_mp4(str(Path(media_dir))):
+        if mtime > best_any[0]:
+            best_any = (mtime, path)
+        if mtime > best_match[0] and scene_name in name:
+            best_match = (mtime, path)
     
-    if not video_files:
-        return None
-    
-    # Return most recent
-    video_files.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-    return str(video_files[0])
+    return best_match[1] or best_any[1]
 
 
 def create_summary_report(iterations_dir: str) -> Dict:
@@ -214,8 +430,7 @@ def create_summary_report(iterations_dir: str) -> Dict:
     for iter_dir in sorted(iterations_path.glob("iteration_*")):
         metadata_path = iter_dir / "metadata.json"
         if metadata_path.exists():
-            with open(metadata_path, 'r') as f:
-                iterations.append(json.load(f))
+            iterations.append(loads_json(metadata_path.read_bytes()))
     
     summary = {
         "iterations": iterations,
@@ -228,6 +443,70 @@ def create_summary_report(iterations_dir: str) -> Dict:
     return summary
 
 
+def compile_prompt_template(template: str) -> List[Tuple[str, Optional[str], str, Optional[str]]]:
+    """
+    Split a str.format-style template into (literal, field, spec, conversion) segments.
+    
+    Parsing once lets render_prompt_template fill the template repeatedly
+    without re-scanning it.
+    
+    Args:
+        template: Template text with {named} placeholders
+        
+    Returns:
+        List of segments for render_prompt_template
+    """
+    return [
+        (literal, field, spec or '', conversion)
+        for literal, field, spec, conversion in Formatter().parse(template)
+    ]
+
+
+def render_prompt_template(segments: List[Tuple[str, Optional[str], str, Optional[str]]],
+                           **values) -> str:
+    """
+    Fill a template compiled by compile_prompt_template.
+    
+    Args:
+        segments: Output of compile_prompt_template
+        **values: Values for each placeholder
+        
+    Returns:
+        Rendered prompt text
+    """
+    formatter = Formatter()
+    parts = []
+    for literal, field, spec, conversion in segments:
+        parts.append(literal)
+        if field is not None:
+            value = formatter.convert_field(values[field], conversion)
+            parts.append(format(value, spec))
+    return ''.join(parts)
+
+
+def load_prompt_template(path: str) -> Tuple[str, Tuple[Tuple[str, Optional[str], str, Optional[str]], ...]]:
+    """
+    Read and compile a prompt template, cached per (path, mtime).
+    
+    Improvers in the same process share one read and one parse; editing the
+    file invalidates the entry.
+    
+    Args:
+        path: Path to the prompt file
+        
+    Returns:
+        Tuple of (template text, compiled segments)
+    """
+    return _load_prompt_template(str(path), os.stat(path).st_mtime_ns)
+
+
+@lru_cache(maxsize=8)
+def _load_prompt_template(path: str, mtime_ns: int):
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    return text, tuple(compile_prompt_template(text))
+
+
 def print_progress(iteration: int, score: float, max_iterations: int):
     """
     Print formatted progress information.
@@ -237,14 +516,16 @@ def print_progress(iteration: int, score: float, max_iterations: int):
         score: Current quality score
         max_iterations: Maximum number of iterations
     """
-    bar_length = 40
-    filled = int(bar_length * (score / 10))
-    bar = "█" * filled + "░" * (bar_length - filled)
-    
-    print()
-    print("=" * 70)
-    print(f"  ITERATION {iteration}/{max_iterations}")
-    print(f"  Quality Score: {score:.1f}/10")
-    print(f"  Progress: [{bar}] {score*10:.0f}%")
-    print("=" * 70)
-    print()
+    filled = int(_BAR_LENGTH * (score / 10))
+    bar = _BAR_FULL[:filled] + _BAR_EMPTY[filled:]
+    rule = "=" * 70
+    
+    # Build the whole block and emit it with one write
+    sys.stdout.write(
+        f"\n{rule}\n"
+        f"  ITERATION {iteration}/{max_iterations}\n"
+        f"  Quality Score: {score:.1f}/10\n"
+        f"  Progress: [{bar}] {score*10:.0f}%\n"
+        f"{rule}\n\n"
+    )
+    sys.stdout.flush()
@@ -13,11 +13,9 @@ import sys
 import json
 import time
 import subprocess
-import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional
-
-import google.generativeai as genai
+from typing import Dict, Optional, Tuple
 
 from utils import (
     validate_python_syntax,
@@ -25,9 +23,15 @@ from utils import (
     extract_json_from_text,
     clean_code_from_response,
     save_iteration,
+    generate_with_retry,
+    atomic_write,
+    link_or_copy,
     find_rendered_video,
     create_summary_report,
-    print_progress
+    load_prompt_template,
+    render_prompt_template,
+    print_progress,
+    dumps_json
 )
 
 
@@ -61,6 +65,7 @@ class VideoImprover:
         self.rendered_videos_dir = self.base_dir / "rendered_videos"
         self.prompts_dir = self.base_dir / "prompts"
         self.media_dir = self.base_dir / "media"
+        self.render_log_path = self.iterations_dir / "render.log"
         
         # Ensure directories exist
         self.iterations_dir.mkdir(exist_ok=True)
@@ -74,12 +79,22 @@ class VideoImprover:
                 "Run setup_api.py first or set the environment variable."
             )
         
-        genai.configure(api_key=api_key)
+        # Imported here so `--help` and argument errors skip the grpc/protobuf import
+        import google.generativeai as genai
+        self._genai = genai
+        
+        # gRPC keeps one HTTP/2 channel open for every call made through self.model
+        genai.configure(api_key=api_key, transport="grpc")
         self.model = genai.GenerativeModel('gemini-2.5-flash')
         
+        # Background thread for Gemini uploads, overlapped with local file work
+        self._uploader = ThreadPoolExecutor(max_workers=1)
+        
         # Load prompts
-        self.analysis_prompt = self._load_prompt("video_analysis_prompt.txt")
-        self.improvement_prompt = self._load_prompt("code_improvement_prompt.txt")
+        self.analysis_prompt, _ = self._load_prompt("video_analysis_prompt.txt")
+        self.improvement_prompt, self._improvement_segments = self._load_prompt(
+            "code_improvement_prompt.txt"
+        )
         
         print("✓ VideoImprover initialized")
         print(f"  Script: {self.script_path}")
@@ -87,14 +102,13 @@ class VideoImprover:
         print(f"  Target score: {self.target_score}/10")
         print(f"  Rendering mode: {'Docker' if self.use_docker else 'Local'}")
     
-    def _load_prompt(self, filename: str) -> str:
-        """Load a prompt template from file."""
+    def _load_prompt(self, filename: str) -> Tuple[str, tuple]:
+        """Load a prompt template from file, along with its compiled segments."""
         prompt_path = self.prompts_dir / filename
         if not prompt_path.exists():
             raise FileNotFoundError(f"Prompt template not found: {prompt_path}")
         
-        with open(prompt_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        return load_prompt_template(str(prompt_path))
     
     def render_video(self) -> Optional[str]:
         """
@@ -114,6 +128,39 @@ class VideoImprover:
             print(f"✗ Rendering failed: {e}")
             return None
     
+    def _run_render_command(self, cmd) -> bool:
+        """
+        Run a render command, streaming its output to the render log.
+        
+        Returns:
+            True if the command exited successfully
+        """
+        with open(self.render_log_path, 'wb') as log_f:
+            result = subprocess.run(
+                cmd,
+                cwd=str(self.base_dir),
+                stdout=log_f,
+                stderr=subprocess.STDOUT
+            )
+        return result.returncode == 0
+    
+    def _read_render_log_tail(self, max_bytes: int = 4096) -> str:
+        """Return the last max_bytes of the render log."""
+        with open(self.render_log_path, 'rb') as log_f:
+            log_f.seek(0, os.SEEK_END)
+            log_f.seek(max(0, log_f.tell() - max_bytes))
+            return log_f.read().decode('utf-8', errors='replace')
+    
+    def _locate_rendered_video(self, script_stem: str) -> Optional[str]:
+        """
+        Return the rendered video path, checking Manim's -ql output location
+        before falling back to searching the media directory.
+        """
+        expected = self.media_dir / "videos" / script_stem / "480p15" / "IntegralExplanation.mp4"
+        if expected.exists():
+            return str(expected)
+        return find_rendered_video(str(self.media_dir))
+    
     def _render_with_docker(self) -> Optional[str]:
         """Render video using Docker container."""
         # Build command to run Manim in Docker
@@ -121,25 +168,18 @@ class VideoImprover:
             "docker", "run", "--rm",
             "-v", f"{self.base_dir.absolute()}:/manim",
             "manim-container",  # Assumes you've built the Docker image with this name
-            "manim", "-pql", "test.py", "IntegralExplanation"
+            "manim", "-ql", "test.py", "IntegralExplanation"
         ]
         
         print(f"  Running: {' '.join(cmd)}")
         
-        result = subprocess.run(
-            cmd,
-            cwd=str(self.base_dir),
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
+        if not self._run_render_command(cmd):
             print(f"✗ Docker rendering failed:")
-            print(result.stderr)
+            print(self._read_render_log_tail())
             return None
         
         # Find the rendered video
-        video_path = find_rendered_video(str(self.media_dir))
+        video_path = self._locate_rendered_video("test")
         
         if video_path:
             print(f"✓ Video rendered: {video_path}")
@@ -150,24 +190,17 @@ class VideoImprover:
     
     def _render_local(self) -> Optional[str]:
         """Render video using local Manim installation."""
-        cmd = ["manim", "-pql", str(self.script_path), "IntegralExplanation"]
+        cmd = ["manim", "-ql", str(self.script_path), "IntegralExplanation"]
         
         print(f"  Running: {' '.join(cmd)}")
         
-        result = subprocess.run(
-            cmd,
-            cwd=str(self.base_dir),
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
+        if not self._run_render_command(cmd):
             print(f"✗ Local rendering failed:")
-            print(result.stderr)
+            print(self._read_render_log_tail())
             return None
         
         # Find the rendered video
-        video_path = find_rendered_video(str(self.media_dir))
+        video_path = self._locate_rendered_video(self.script_path.stem)
         
         if video_path:
             print(f"✓ Video rendered: {video_path}")
@@ -176,12 +209,43 @@ class VideoImprover:
             print("✗ Could not find rendered video")
             return None
     
-    def analyze_video(self, video_path: str) -> Optional[Dict]:
+    def upload_video(self, video_path: str):
+        """
+        Upload a video to Gemini and wait until it has been processed.
+        
+        Args:
+            video_path: Path to video file
+            
+        Returns:
+            Processed Gemini file handle
+        """
+        print("  Uploading video to Gemini...")
+        video_file = self._genai.upload_file(
+            path=video_path,
+            mime_type="video/mp4",
+            resumable=True
+        )
+        
+        # Wait for video to be processed, backing off from a short first poll
+        delay = 0.2
+        while video_file.state.name == "PROCESSING":
+            print("  Processing video...")
+            time.sleep(delay)
+            delay = min(delay * 2, 4.0)
+            video_file = self._genai.get_file(video_file.name)
+        
+        if video_file.state.name == "FAILED":
+            raise Exception("Video processing failed")
+        
+        return video_file
+    
+    def analyze_video(self, video_path: str, pending_upload: Optional[Future] = None) -> Optional[Dict]:
         """
         Analyze video quality using Gemini Pro.
         
         Args:
             video_path: Path to video file
+            pending_upload: Upload already started with upload_video, if any
             
         Returns:
             Analysis feedback as dictionary or None if analysis failed
@@ -189,23 +253,16 @@ class VideoImprover:
         print("\n🔍 Analyzing video with Gemini Pro...")
         
         try:
-            # Upload video file
-            print("  Uploading video to Gemini...")
-            video_file = genai.upload_file(path=video_path)
-            
-            # Wait for video to be processed
-            while video_file.state.name == "PROCESSING":
-                print("  Processing video...")
-                time.sleep(2)
-                video_file = genai.get_file(video_file.name)
-            
-            if video_file.state.name == "FAILED":
-                raise Exception("Video processing failed")
+            if pending_upload is not None:
+                video_file = pending_upload.result()
+            else:
+                video_file = self.upload_video(video_path)
             
             print("  Generating analysis...")
             
             # Generate analysis
-            response = self.model.generate_content(
+            response = generate_with_retry(
+                self.model,
                 [video_file, self.analysis_prompt],
                 request_options={"timeout": 120}
             )
@@ -249,7 +306,8 @@ class VideoImprover:
                 for i, item in enumerate(feedback.get("priority_improvements", []))
             ])
             
-            prompt = self.improvement_prompt.format(
+            prompt = render_prompt_template(
+                self._improvement_segments,
                 iteration=iteration,
                 previous_score=feedback.get("overall_score", 0),
                 feedback=json.dumps(feedback, indent=2),
@@ -258,7 +316,8 @@ class VideoImprover:
             )
             
             # Generate improved code
-            response = self.model.generate_content(
+            response = generate_with_retry(
+                self.model,
                 prompt,
                 request_options={"timeout": 120}
             )
@@ -299,9 +358,9 @@ class VideoImprover:
         print("  🚀 STARTING ITERATIVE VIDEO IMPROVEMENT")
         print("=" * 70)
         
-        # Read initial code
-        with open(self.script_path, 'r', encoding='utf-8') as f:
-            current_code = f.read()
+        # Read initial code; the encoded form is kept for save_iteration
+        current_code_bytes = self.script_path.read_bytes()
+        current_code = current_code_bytes.decode('utf-8')
         
         for iteration in range(1, self.max_iterations + 1):
             print_progress(iteration, 0, self.max_iterations)
@@ -312,13 +371,24 @@ class VideoImprover:
                 print("⚠️  Rendering failed, stopping iteration")
                 break
             
-            # Copy video to rendered_videos folder
+            # Start the Gemini upload while the video is saved locally
+            pending_upload = self._uploader.submit(self.upload_video, video_path)
+            
+            # Link (or copy) video into rendered_videos folder
             video_copy = self.rendered_videos_dir / f"video_iteration_{iteration:02d}.mp4"
-            shutil.copy2(video_path, video_copy)
+            link_or_copy(video_path, video_copy)
             print(f"  Saved video to: {video_copy}")
             
             # Analyze video
-            feedback = self.analyze_video(video_path)
+            feedback = self.analyze_video(video_path, pending_upload)
+            
+            # Manim rewrites its output file in place, which would also change
+            # the linked copy; unlinking it makes the next render a new file
+            try:
+                os.unlink(video_path)
+            except OSError:
+                pass
+            
             if not feedback:
                 print("⚠️  Analysis failed, stopping iteration")
                 break
@@ -326,8 +396,8 @@ class VideoImprover:
             # Save iteration
             save_iteration(
                 iteration,
-                current_code,
-                video_path,
+                current_code_bytes,
+                str(video_copy),
                 feedback,
                 str(self.iterations_dir)
             )
@@ -354,15 +424,12 @@ class VideoImprover:
                 print("⚠️  Code improvement failed, stopping iteration")
                 break
             
-            # Update script file
-            with open(self.script_path, 'w', encoding='utf-8') as f:
-                f.write(improved_code)
+            # Update script file (encoded once, reused by save_iteration next round)
+            current_code_bytes = improved_code.encode('utf-8')
+            atomic_write(self.script_path, current_code_bytes)
             
             current_code = improved_code
             print(f"✓ Script updated for next iteration")
-            
-            # Brief pause between iterations
-            time.sleep(2)
         
         # Generate summary report
         summary = create_summary_report(str(self.iterations_dir))
@@ -423,8 +490,7 @@ def main():
         
         # Save summary to file
         summary_path = Path("iterations") / "summary.json"
-        with open(summary_path, 'w') as f:
-            json.dump(summary, f, indent=2)
+        summary_path.write_bytes(dumps_json(summary))
         
         print(f"\n✓ Summary saved to: {summary_path}")
         
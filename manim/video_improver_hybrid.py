@@ -15,26 +15,31 @@ Benefits:
 
 import os
 import sys
-import json
-import time
-import subprocess
-import shutil
+import importlib.util
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 
 import google.generativeai as genai
+from manim import tempconfig
 
 from utils import (
     validate_python_syntax,
     validate_manim_structure,
     clean_code_from_response,
     save_iteration,
+    generate_with_retry,
+    atomic_write,
+    fast_copy,
     find_rendered_video,
     create_summary_report,
-    print_progress
+    load_prompt_template,
+    render_prompt_template,
+    print_progress,
+    dumps_json
 )
 
 from code_analyzer import analyze_manim_code
+from code_context_cache import CodeContextCache
 
 
 class HybridVideoImprover:
@@ -83,11 +88,17 @@ class HybridVideoImprover:
                 "Run setup_api.py first or set the environment variable."
             )
         
-        genai.configure(api_key=api_key)
+        # gRPC keeps one long-lived channel for every Gemini call
+        genai.configure(api_key=api_key, transport="grpc")
         self.model = genai.GenerativeModel('gemini-2.5-flash')
         
+        # Later prompts send a diff against the cached starting script
+        self.code_cache = CodeContextCache('gemini-2.5-flash')
+        
         # Load code improvement prompt
-        self.improvement_prompt = self._load_prompt("code_improvement_prompt.txt")
+        self.improvement_prompt, self._improvement_segments = self._load_prompt(
+            "code_improvement_prompt.txt"
+        )
         
         print("✓ Hybrid VideoImprover initialized")
         print(f"  Script: {self.script_path}")
@@ -96,38 +107,40 @@ class HybridVideoImprover:
         print(f"  Analysis mode: CODE ANALYSIS (fast)")
         print(f"  Render mode: {'Final only' if self.render_final_only else 'Every iteration'}")
     
-    def _load_prompt(self, filename: str) -> str:
-        """Load a prompt template from file."""
+    def _load_prompt(self, filename: str) -> Tuple[str, tuple]:
+        """Load a prompt template from file, along with its compiled segments."""
         prompt_path = self.prompts_dir / filename
         if not prompt_path.exists():
             raise FileNotFoundError(f"Prompt template not found: {prompt_path}")
         
-        with open(prompt_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        return load_prompt_template(str(prompt_path))
     
     def render_video(self) -> Optional[str]:
-        """Render the Manim video using local installation."""
+        """Render the Manim video in-process (no per-iteration interpreter or manim import)."""
         print("\n📹 Rendering video...")
         
         try:
-            cmd = ["manim", "-pql", str(self.script_path), "IntegralExplanation"]
+            print(f"  Rendering {self.script_path.name} in-process")
             
-            print(f"  Running: {' '.join(cmd)}")
-            
-            result = subprocess.run(
-                cmd,
-                cwd=str(self.base_dir),
-                capture_output=True,
-                text=True
-            )
+            # Re-exec the script each time so the latest improved code is used
+            spec = importlib.util.spec_from_file_location("user_scene", self.script_path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
             
-            if result.returncode != 0:
-                print(f"✗ Rendering failed:")
-                print(result.stderr)
-                return None
+            with tempconfig({
+                "quality": "low_quality",
+                "preview": False,
+                "write_to_movie": True,
+                "media_dir": str(self.media_dir),
+                "input_file": str(self.script_path),
+            }):
+                scene = getattr(module, "IntegralExplanation")()
+                scene.render()
+                video_path = str(scene.renderer.file_writer.movie_file_path)
             
-            # Find the rendered video
-            video_path = find_rendered_video(str(self.media_dir))
+            # Fall back to searching the media dir
+            if not os.path.exists(video_path):
+                video_path = find_rendered_video(str(self.media_dir))
             
             if video_path:
                 print(f"✓ Video rendered: {video_path}")
@@ -206,16 +219,20 @@ DETAILED ISSUES:
                 detailed_feedback += f"  Problem: {issue['description']}\n"
                 detailed_feedback += f"  Fix: {issue['suggestion']}\n"
             
-            prompt = self.improvement_prompt.format(
+            model, code_text = self.code_cache.prepare(current_code, self.model)
+            
+            prompt = render_prompt_template(
+                self._improvement_segments,
                 iteration=iteration,
                 previous_score=feedback.get("overall_score", 0),
                 feedback=detailed_feedback,
                 priority_improvements=priority_improvements,
-                current_code=current_code
+                current_code=code_text
             )
             
             # Generate improved code
-            response = self.model.generate_content(
+            response = generate_with_retry(
+                model,
                 prompt,
                 request_options={"timeout": 120}
             )
@@ -294,7 +311,7 @@ DETAILED ISSUES:
                     if video_path:
                         # Copy to rendered_videos
                         video_copy = self.rendered_videos_dir / f"video_final.mp4"
-                        shutil.copy2(video_path, video_copy)
+                        fast_copy(video_path, video_copy)
                         print(f"  ✓ Final video: {video_copy}")
                 break
             
@@ -306,7 +323,7 @@ DETAILED ISSUES:
                 video_path = self.render_video()
                 if video_path:
                     video_copy = self.rendered_videos_dir / f"video_final.mp4"
-                    shutil.copy2(video_path, video_copy)
+                    fast_copy(video_path, video_copy)
                 break
             
             # Generate improved code
@@ -315,15 +332,13 @@ DETAILED ISSUES:
                 print("⚠️  Code improvement failed, stopping iteration")
                 break
             
-            # Update script file
-            with open(self.script_path, 'w', encoding='utf-8') as f:
-                f.write(improved_code)
+            # Update script file atomically so a render never loads a partial script
+            atomic_write(self.script_path, improved_code)
             
             current_code = improved_code
             print(f"✓ Script updated for next iteration")
-            
-            # Brief pause
-            time.sleep(1)
+        
+        self.code_cache.release()
         
         # Generate summary report
         summary = create_summary_report(str(self.iterations_dir))
@@ -385,8 +400,7 @@ def main():
         
         # Save summary to file
         summary_path = Path("iterations") / "summary.json"
-        with open(summary_path, 'w') as f:
-            json.dump(summary, f, indent=2)
+        summary_path.write_bytes(dumps_json(summary))
         
         print(f"\n✓ Summary saved to: {summary_path}")
         
@@ -9,13 +9,14 @@ Final integrated system:
 """
 
 import os
+import re
+import multiprocessing
 import sys
-import json
-import time
 import subprocess
-import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 
 import google.generativeai as genai
 
@@ -24,13 +25,32 @@ from utils import (
     validate_manim_structure,
     clean_code_from_response,
     save_iteration,
+    generate_with_retry,
+    atomic_write,
+    fast_copy,
     find_rendered_video,
     create_summary_report,
-    print_progress
+    load_prompt_template,
+    render_prompt_template,
+    print_progress,
+    dumps_json
 )
 
 from overlap_detector_scene import analyze_scene_with_overlap_detection
 from render_cache import RenderCache
+from code_context_cache import CodeContextCache
+
+
+# How many validated Gemini candidates get a trial overlap analysis
+SPECULATIVE_CANDIDATES = 2
+
+# Manim output lines after which the render cannot succeed
+_FATAL_RENDER_RE = re.compile(
+    r"\b(?:ImportError|ModuleNotFoundError|FileNotFoundError|SyntaxError|NameError)\b"
+)
+
+# Lines of manim output kept for the failure message
+RENDER_LOG_TAIL = 40
 
 
 class MobjectVideoImprover:
@@ -41,7 +61,8 @@ class MobjectVideoImprover:
         script_path: str = "test.py",
         max_iterations: int = 5,
         target_score: float = 8.0,
-        scene_name: str = "IntegralExplanation"
+        scene_name: str = "IntegralExplanation",
+        candidate_count: int = 4
     ):
         """
         Initialize the mobject video improver.
@@ -51,11 +72,13 @@ class MobjectVideoImprover:
             max_iterations: Maximum number of improvement iterations
             target_score: Target quality score (0-10)
             scene_name: Name of the Manim scene class
+            candidate_count: Number of code candidates requested per Gemini call
         """
         self.script_path = Path(script_path)
         self.max_iterations = max_iterations
         self.target_score = target_score
         self.scene_name = scene_name
+        self.candidate_count = candidate_count
         
         # Setup directories
         self.base_dir = self.script_path.parent
@@ -71,6 +94,9 @@ class MobjectVideoImprover:
         # Initialize render cache
         self.render_cache = RenderCache(str(self.base_dir / "render_cache"))
         
+        # Single render worker: renders overlap with analysis/Gemini, never with each other
+        self._render_pool = ThreadPoolExecutor(max_workers=1)
+        
         # Setup Gemini
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
@@ -79,11 +105,17 @@ class MobjectVideoImprover:
                 "Run setup_api.py first or set the environment variable."
             )
         
-        genai.configure(api_key=api_key)
+        # gRPC keeps one long-lived channel for every Gemini call
+        genai.configure(api_key=api_key, transport="grpc")
         self.model = genai.GenerativeModel('gemini-2.5-flash')
         
+        # Later prompts send a diff against the cached starting script
+        self.code_cache = CodeContextCache('gemini-2.5-flash')
+        
         # Load code improvement prompt
-        self.improvement_prompt = self._load_prompt("code_improvement_prompt.txt")
+        self.improvement_prompt, self._improvement_segments = self._load_prompt(
+            "code_improvement_prompt.txt"
+        )
         
         print("✓ Mobject VideoImprover initialized")
         print(f"  Script: {self.script_path}")
@@ -92,14 +124,13 @@ class MobjectVideoImprover:
         print(f"  Target score: {self.target_score}/10")
         print(f"  Analysis: MOBJECT OVERLAP DETECTION (fast + accurate)")
     
-    def _load_prompt(self, filename: str) -> str:
-        """Load a prompt template from file."""
+    def _load_prompt(self, filename: str) -> Tuple[str, tuple]:
+        """Load a prompt template from file, along with its compiled segments."""
         prompt_path = self.prompts_dir / filename
         if not prompt_path.exists():
             raise FileNotFoundError(f"Prompt template not found: {prompt_path}")
         
-        with open(prompt_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        return load_prompt_template(str(prompt_path))
     
     def render_video(self, current_code: str) -> Optional[str]:
         """Render the Manim video (with caching)."""
@@ -113,20 +144,34 @@ class MobjectVideoImprover:
         print("  Rendering video...")
         
         try:
-            cmd = ["manim", "-pql", str(self.script_path), self.scene_name]
+            cmd = ["manim", "-ql", str(self.script_path), self.scene_name]
             
             print(f"  Running: {' '.join(cmd)}")
             
-            result = subprocess.run(
+            # Stream output instead of buffering it; stop as soon as a fatal
+            # error shows up rather than waiting for manim to exit
+            proc = subprocess.Popen(
                 cmd,
                 cwd=str(self.base_dir),
-                capture_output=True,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
                 text=True
             )
+            tail = deque(maxlen=RENDER_LOG_TAIL)
+            fatal = False
+            with proc.stdout:
+                for line in proc.stdout:
+                    tail.append(line)
+                    if _FATAL_RENDER_RE.search(line):
+                        fatal = True
+                        proc.terminate()
+                        break
+            returncode = proc.wait()
             
-            if result.returncode != 0:
+            if fatal or returncode != 0:
                 print(f"✗ Rendering failed:")
-                print(result.stderr)
+                print("".join(tail))
                 return None
             
             # Find the rendered video
@@ -211,35 +256,49 @@ DETECTED OVERLAP ISSUES:
                 detailed_feedback += f"  At timestamp: {issue['timestamp']:.1f}s\n"
                 detailed_feedback += f"  Fix: {issue['suggestion']}\n"
             
-            prompt = self.improvement_prompt.format(
+            model, code_text = self.code_cache.prepare(current_code, self.model)
+            
+            prompt = render_prompt_template(
+                self._improvement_segments,
                 iteration=iteration,
                 previous_score=feedback.get("overall_score", 0),
                 feedback=detailed_feedback,
                 priority_improvements=priority_improvements,
-                current_code=current_code
+                current_code=code_text
             )
             
-            # Generate improved code
-            response = self.model.generate_content(
+            # Generate several candidates in one call so a single bad
+            # completion doesn't waste the iteration
+            response = generate_with_retry(
+                model,
                 prompt,
+                generation_config=genai.GenerationConfig(
+                    candidate_count=self.candidate_count
+                ),
                 request_options={"timeout": 120}
             )
             
-            # Extract code from response
-            improved_code = clean_code_from_response(response.text)
+            # Extract code from each candidate
+            candidates = [
+                clean_code_from_response(
+                    "".join(part.text for part in candidate.content.parts)
+                )
+                for candidate in response.candidates
+            ]
             
-            # Validate syntax
-            is_valid, error = validate_python_syntax(improved_code)
-            if not is_valid:
-                print(f"✗ Generated code has syntax errors: {error}")
-                return None
+            # Validate all candidates in parallel
+            with ThreadPoolExecutor() as pool:
+                errors = list(pool.map(self._validate_candidate, candidates))
             
-            # Validate Manim structure
-            is_valid, error = validate_manim_structure(improved_code)
-            if not is_valid:
-                print(f"✗ Generated code missing required structure: {error}")
+            survivors = [code for code, error in zip(candidates, errors) if error is None]
+            if not survivors:
+                print(f"✗ No valid candidates ({len(candidates)} generated): {errors[0]}")
                 return None
             
+            print(f"✓ {len(survivors)}/{len(candidates)} candidates passed validation")
+            
+            improved_code = self._pick_best_candidate(survivors[:SPECULATIVE_CANDIDATES])
+            
             print("✓ Improved code generated and validated")
             
             return improved_code
@@ -248,16 +307,87 @@ DETECTED OVERLAP ISSUES:
             print(f"✗ Code improvement failed: {e}")
             return None
     
+    @staticmethod
+    def _validate_candidate(code: str) -> Optional[str]:
+        """Return the first validation error for a candidate, or None if it passes."""
+        is_valid, error = validate_python_syntax(code)
+        if not is_valid:
+            return f"syntax error: {error}"
+        
+        is_valid, error = validate_manim_structure(code)
+        if not is_valid:
+            return f"missing required structure: {error}"
+        
+        return None
+    
+    def _pick_best_candidate(self, candidates: list) -> str:
+        """
+        Run overlap analysis on each candidate in its own process and keep
+        the highest-scoring one.
+        
+        Args:
+            candidates: Validated candidate scripts, best-ranked first
+            
+        Returns:
+            The candidate with the best overall score
+        """
+        if len(candidates) == 1:
+            return candidates[0]
+        
+        print(f"  Trial-analyzing {len(candidates)} candidates...")
+        
+        # Candidates live next to the script so relative imports/assets resolve;
+        # each analysis mutates manim's global config, hence separate processes
+        paths = [
+            self.base_dir / f".candidate_{k}_{self.script_path.name}"
+            for k in range(len(candidates))
+        ]
+        try:
+            for path, code in zip(paths, candidates):
+                path.write_text(code, encoding='utf-8')
+            
+            # Spawned, not forked: the render/upload threads and the gRPC channel
+            # may hold locks a forked child would inherit and deadlock on
+            with ProcessPoolExecutor(
+                max_workers=min(len(candidates), os.cpu_count() or 1),
+                mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                futures = [
+                    pool.submit(analyze_scene_with_overlap_detection, str(path), self.scene_name)
+                    for path in paths
+                ]
+                scores = []
+                for future in futures:
+                    try:
+                        scores.append(future.result().get("overall_score", 0))
+                    except Exception as e:
+                        print(f"  Candidate analysis failed: {e}")
+                        scores.append(-1)
+        finally:
+            for path in paths:
+                path.unlink(missing_ok=True)
+        
+        best = max(range(len(candidates)), key=scores.__getitem__)
+        print(f"  Candidate scores: {scores} -> using candidate {best + 1}")
+        return candidates[best]
+    
     def open_video(self, video_path: str):
         """Open video in default player."""
         try:
             print(f"\n🎬 Opening video: {video_path}")
             if sys.platform == "win32":
-                os.startfile(video_path)
-            elif sys.platform == "darwin":  # macOS
-                subprocess.run(["open", video_path])
-            else:  # Linux
-                subprocess.run(["xdg-open", video_path])
+                os.startfile(video_path)  # already returns immediately
+                return
+            
+            opener = "open" if sys.platform == "darwin" else "xdg-open"
+            # Detached: don't wait on the viewer or share our stdio/session
+            subprocess.Popen(
+                [opener, video_path],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True
+            )
         except Exception as e:
             print(f"  Could not open video automatically: {e}")
             print(f"  Please open manually: {video_path}")
@@ -280,22 +410,35 @@ DETECTED OVERLAP ISSUES:
         for iteration in range(1, self.max_iterations + 1):
             print_progress(iteration, 0, self.max_iterations)
             
-            # Render video (with caching)
-            video_path = self.render_video(current_code)
+            # Render in the background; overlap analysis only needs the script,
+            # so it and the Gemini call run while Manim renders
+            pending_render = self._render_pool.submit(self.render_video, current_code)
+            
+            # Analyze overlaps
+            feedback = self.analyze_overlaps() or {}
+            score = feedback.get("overall_score", 0)
+            is_satisfactory = feedback.get("is_satisfactory", False)
+            target_reached = is_satisfactory or score >= self.target_score
+            
+            # Generate improved code (the script file is not touched until the
+            # render has finished reading it)
+            improved_code = None
+            if feedback and not target_reached and iteration < self.max_iterations:
+                improved_code = self.improve_code(current_code, feedback, iteration)
+            
+            video_path = pending_render.result()
             if not video_path:
                 print("⚠️  Rendering failed, stopping iteration")
                 break
             
             # Copy video to rendered_videos folder
             video_copy = self.rendered_videos_dir / f"video_iteration_{iteration:02d}.mp4"
-            shutil.copy2(video_path, video_copy)
+            fast_copy(video_path, video_copy)
             print(f"  Saved video to: {video_copy}")
             
             # Open video for viewing
             self.open_video(str(video_copy))
             
-            # Analyze overlaps
-            feedback = self.analyze_overlaps()
             if not feedback:
                 print("⚠️  Analysis failed, stopping iteration")
                 break
@@ -304,18 +447,15 @@ DETECTED OVERLAP ISSUES:
             save_iteration(
                 iteration,
                 current_code,
-                video_path,
+                str(video_copy),
                 feedback,
                 str(self.iterations_dir)
             )
             
             # Check if satisfactory
-            score = feedback.get("overall_score", 0)
-            is_satisfactory = feedback.get("is_satisfactory", False)
-            
             print_progress(iteration, score, self.max_iterations)
             
-            if is_satisfactory or score >= self.target_score:
+            if target_reached:
                 print("🎉 Target quality achieved!")
                 print(f"   Final score: {score}/10")
                 print(f"   No critical overlaps detected!")
@@ -326,21 +466,17 @@ DETECTED OVERLAP ISSUES:
                 print("⚠️  Maximum iterations reached")
                 break
             
-            # Generate improved code
-            improved_code = self.improve_code(current_code, feedback, iteration)
             if not improved_code:
                 print("⚠️  Code improvement failed, stopping iteration")
                 break
             
-            # Update script file
-            with open(self.script_path, 'w', encoding='utf-8') as f:
-                f.write(improved_code)
+            # Update script file atomically so a render never loads a partial script
+            atomic_write(self.script_path, improved_code)
             
             current_code = improved_code
             print(f"✓ Script updated for next iteration")
-            
-            # Brief pause
-            time.sleep(2)
+        
+        self.code_cache.release()
         
         # Generate summary report
         summary = create_summary_report(str(self.iterations_dir))
@@ -386,6 +522,12 @@ def main():
         default=8.0,
         help="Target quality score 0-10 (default: 8.0)"
     )
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        default=4,
+        help="Gemini code candidates per iteration (default: 4)"
+    )
     
     args = parser.parse_args()
     
@@ -394,15 +536,15 @@ def main():
             script_path=args.script,
             max_iterations=args.max_iterations,
             target_score=args.target_score,
-            scene_name=args.scene
+            scene_name=args.scene,
+            candidate_count=args.candidates
         )
         
         summary = improver.run()
         
         # Save summary to file
         summary_path = Path("iterations") / "summary.json"
-        with open(summary_path, 'w') as f:
-            json.dump(summary, f, indent=2)
+        summary_path.write_bytes(dumps_json(summary))
         
         print(f"\n✓ Summary saved to: {summary_path}")
         
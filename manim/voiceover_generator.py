@@ -4,16 +4,110 @@ Generates narration script and adds ElevenLabs voiceover to videos
 """
 
 import os
+import re
 import json
-import google.generativeai as genai
-from elevenlabs.client import ElevenLabs
-from elevenlabs import save
+import shutil
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
 import subprocess
 from pathlib import Path
 
 
+# Narration is synthesized in sentence-aligned segments of about this size,
+# a few at a time, and written out in order as they finish
+TTS_SEGMENT_CHARS = 400
+TTS_CONCURRENCY = int(os.getenv("ELEVENLABS_CONCURRENCY", "3"))
+# Retries for rate-limited (HTTP 429) ElevenLabs requests, backing off from 1s
+TTS_MAX_RETRIES = 4
+# Audio chunks are written as they arrive through a buffer of this size
+AUDIO_WRITE_BUFFER = 1 << 20
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+
+# Hardware H.264 encoders, in order of preference, for re-encoding merges
+HW_VIDEO_ENCODERS = ["h264_nvenc", "h264_qsv", "h264_vaapi", "h264_videotoolbox"]
+
+
+@lru_cache(maxsize=1)
+def ffmpeg_path():
+    """Locate ffmpeg on PATH once per process (no subprocess)"""
+    return shutil.which("ffmpeg")
+
+
+def _encoder_works(video_encoder):
+    """One-frame test encode; builds list hardware encoders the machine cannot run"""
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", "color=s=64x64:d=0.04",
+        "-frames:v", "1",
+        *video_codec_args(video_encoder),
+        "-f", "null", "-"
+    ]
+    try:
+        return subprocess.run(cmd, capture_output=True, timeout=15).returncode == 0
+    except (subprocess.TimeoutExpired, FileNotFoundError):
+        return False
+
+
+@lru_cache(maxsize=1)
+def detect_video_encoder():
+    """Pick the first hardware H.264 encoder that can actually encode here, else libx264"""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            capture_output=True, text=True, check=True
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "libx264"
+    available = {line.split()[1] for line in result.stdout.splitlines() if len(line.split()) > 1}
+    return next(
+        (enc for enc in HW_VIDEO_ENCODERS if enc in available and _encoder_works(enc)),
+        "libx264"
+    )
+
+
+def _can_fall_back(video_encoder):
+    """Whether a failed merge is worth retrying with libx264"""
+    if video_encoder == "auto":
+        video_encoder = detect_video_encoder()
+    return video_encoder in HW_VIDEO_ENCODERS
+
+
+def video_codec_args(video_encoder="copy"):
+    """ffmpeg video/audio codec args: stream copy by default, 'auto' picks a hardware encoder"""
+    if video_encoder == "auto":
+        video_encoder = detect_video_encoder()
+    args = ["-c:v", video_encoder]
+    if video_encoder == "h264_vaapi":
+        # VAAPI needs frames uploaded to the GPU
+        args = ["-vaapi_device", "/dev/dri/renderD128", "-vf", "format=nv12,hwupload"] + args
+    return args + [
+        "-c:a", "aac",
+        "-aac_coder", "fast",  # Much quicker than the default twoloop coder
+        "-threads", "0"        # Let ffmpeg use every core
+    ]
+
+
+def split_narration(script, max_chars=TTS_SEGMENT_CHARS):
+    """Group sentences into segments of at most max_chars (longer sentences stay whole)"""
+    segments = []
+    current = ""
+    for sentence in _SENTENCE_END_RE.split(script.strip()):
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            segments.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        segments.append(current)
+    return segments
+
+
 class VoiceoverGenerator:
-    def __init__(self, gemini_api_key=None, elevenlabs_api_key=None):
+    def __init__(self, gemini_api_key=None, elevenlabs_api_key=None,
+                 cache_dir="narration_cache", tts_concurrency=TTS_CONCURRENCY):
         """Initialize with API keys"""
         self.gemini_api_key = gemini_api_key or os.getenv("GEMINI_API_KEY")
         self.elevenlabs_api_key = elevenlabs_api_key or os.getenv("ELEVENLABS_API_KEY")
@@ -23,12 +117,18 @@ class VoiceoverGenerator:
         if not self.elevenlabs_api_key:
             raise ValueError("ELEVENLABS_API_KEY not found")
         
-        # Initialize Gemini
-        genai.configure(api_key=self.gemini_api_key)
-        self.gemini_model = genai.GenerativeModel("gemini-2.0-flash-exp")
+        # Gemini and ElevenLabs clients are created on first use
+        self.gemini_model_name = "gemini-2.0-flash-exp"
+        
+        # Narration scripts keyed by a hash of model + prompt
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True)
         
-        # Initialize ElevenLabs
-        self.elevenlabs_client = ElevenLabs(api_key=self.elevenlabs_api_key)
+        # Most ElevenLabs requests in flight at once (free tier allows 3)
+        self.tts_concurrency = max(1, tts_concurrency)
+        
+        # Probed once; merges just check the flag
+        self._has_ffmpeg = ffmpeg_path() is not None
         
         # Default voice (can be changed)
         self.voice_id = "JBFqnCBsd6RMkjVDRZzb"  # George - calm, professional narrator
@@ -37,6 +137,19 @@ class VoiceoverGenerator:
         print(f"  Gemini: gemini-2.0-flash-exp")
         print(f"  ElevenLabs: Voice ID {self.voice_id}")
     
+    @cached_property
+    def gemini_model(self):
+        """Gemini model, imported and configured on first use (cache hits never need it)"""
+        import google.generativeai as genai
+        genai.configure(api_key=self.gemini_api_key)
+        return genai.GenerativeModel(self.gemini_model_name)
+    
+    @cached_property
+    def elevenlabs_client(self):
+        """ElevenLabs client, imported on first use"""
+        from elevenlabs.client import ElevenLabs
+        return ElevenLabs(api_key=self.elevenlabs_api_key)
+    
     def analyze_manim_code(self, script_path):
         """Read and return Manim code for analysis"""
         with open(script_path, 'r', encoding='utf-8') as f:
@@ -65,8 +178,24 @@ MANIM CODE:
 
 Generate a complete narration script that flows naturally from start to finish. Write only the narration text, nothing else."""
 
+        # Key on whitespace-normalized code so reformatting still hits the cache
+        normalized_code = "\n".join(
+            line.rstrip() for line in manim_code.strip().splitlines() if line.strip()
+        )
+        key = hashlib.sha256(
+            f"{self.gemini_model_name}\0{prompt.replace(manim_code, normalized_code)}".encode("utf-8")
+        ).hexdigest()
+        cached_file = self.cache_dir / f"{key}.txt"
+        
+        if cached_file.exists():
+            script = cached_file.read_text(encoding='utf-8')
+            print(f"✓ Cache HIT: reusing narration ({len(script)} characters)")
+            return script
+        
+        print("  Cache MISS, calling Gemini")
         response = self.gemini_model.generate_content(prompt)
         script = response.text.strip()
+        cached_file.write_text(script, encoding='utf-8')
         
         print(f"✓ Generated {len(script)} characters of narration")
         return script
@@ -77,6 +206,63 @@ Generate a complete narration script that flows naturally from start to finish.
             f.write(script)
         print(f"✓ Script saved: {output_path}")
     
+    def _synthesize_segments(self, script):
+        """Yield MP3 chunks for each narration segment, in order"""
+        segments = split_narration(script)
+        print(f"  Segments: {len(segments)}")
+        if not segments:
+            return
+        client = self.elevenlabs_client  # created once, before the pool threads share it
+        
+        def convert(index):
+            # Neighbouring text keeps intonation continuous across segments
+            return client.text_to_speech.convert(
+                voice_id=self.voice_id,
+                text=segments[index],
+                model_id="eleven_turbo_v2_5",  # Free tier model
+                previous_text=segments[index - 1] if index > 0 else None,
+                next_text=segments[index + 1] if index + 1 < len(segments) else None
+            )
+        
+        # Every request, including the streamed first segment, holds a slot
+        slots = threading.BoundedSemaphore(self.tts_concurrency)
+        
+        def stream(index):
+            # The request is made on the first read, which is where a 429 surfaces
+            delay = 1.0
+            with slots:
+                for attempt in range(TTS_MAX_RETRIES + 1):
+                    chunks = iter(convert(index))
+                    try:
+                        first = next(chunks, None)
+                    except Exception as e:
+                        if getattr(e, "status_code", None) != 429 or attempt == TTS_MAX_RETRIES:
+                            raise
+                        print(f"  ElevenLabs rate limit, retrying segment {index + 1} in {delay:.0f}s")
+                        time.sleep(delay)
+                        delay *= 2
+                        continue
+                    if first is not None:
+                        yield first
+                    yield from chunks
+                    return
+        
+        def synthesize(index):
+            # Keep the chunks as received rather than copying them into one buffer
+            return list(stream(index))
+        
+        # Later segments synthesize while the first streams straight through;
+        # MP3 frames concatenate, so segments are yielded in order
+        with ThreadPoolExecutor(max_workers=self.tts_concurrency) as pool:
+            head = stream(0)
+            first = next(head, None)  # first segment takes its slot before the rest queue
+            later = [pool.submit(synthesize, i) for i in range(1, len(segments))]
+            if first is not None:
+                yield first
+            yield from head
+            for future in later:
+                yield from future.result()
+    
     def generate_audio(self, script, output_path):
         """Generate audio from script using ElevenLabs"""
         print(f"\n🎙️ Generating audio with ElevenLabs...")
@@ -84,19 +270,9 @@ Generate a complete narration script that flows naturally from start to finish.
         print(f"  Text length: {len(script)} characters")
         
         try:
-            # Use text_to_speech.convert method
-            audio_generator = self.elevenlabs_client.text_to_speech.convert(
-                voice_id=self.voice_id,
-                text=script,
-                model_id="eleven_turbo_v2_5"  # Free tier model
-            )
-            
-            # Convert generator to bytes
-            audio_bytes = b"".join(audio_generator)
-            
-            # Save audio
-            with open(output_path, 'wb') as f:
-                f.write(audio_bytes)
+            with open(output_path, 'wb', buffering=AUDIO_WRITE_BUFFER) as f:
+                for chunk in self._synthesize_segments(script):
+                    f.write(chunk)
             
             print(f"✓ Audio generated: {output_path}")
             return True
@@ -105,18 +281,21 @@ Generate a complete narration script that flows naturally from start to finish.
             print(f"✗ Audio generation failed: {e}")
             return False
     
-    def merge_audio_video(self, video_path, audio_path, output_path):
+    def _ffmpeg_available(self):
+        """Check if ffmpeg is available"""
+        if self._has_ffmpeg:
+            return True
+        print("✗ ffmpeg not found. Please install ffmpeg:")
+        print("  Windows: choco install ffmpeg  (or download from ffmpeg.org)")
+        return False
+    
+    def merge_audio_video(self, video_path, audio_path, output_path, video_encoder="copy"):
         """Merge audio with video using ffmpeg"""
         print(f"\n🎬 Merging audio with video...")
         print(f"  Video: {video_path}")
         print(f"  Audio: {audio_path}")
         
-        # Check if ffmpeg is available
-        try:
-            subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True)
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            print("✗ ffmpeg not found. Please install ffmpeg:")
-            print("  Windows: choco install ffmpeg  (or download from ffmpeg.org)")
+        if not self._ffmpeg_available():
             return False
         
         # Merge command
@@ -124,8 +303,7 @@ Generate a complete narration script that flows naturally from start to finish.
             "ffmpeg",
             "-i", video_path,
             "-i", audio_path,
-            "-c:v", "copy",  # Copy video codec (no re-encode)
-            "-c:a", "aac",   # Encode audio as AAC
+            *video_codec_args(video_encoder),  # Copy video unless asked to re-encode
             "-map", "0:v:0", # Use video from first input
             "-map", "1:a:0", # Use audio from second input
             "-shortest",     # End when shortest stream ends
@@ -145,9 +323,70 @@ Generate a complete narration script that flows naturally from start to finish.
             
         except subprocess.CalledProcessError as e:
             print(f"✗ ffmpeg failed: {e.stderr}")
+            if _can_fall_back(video_encoder):
+                print("  Retrying with libx264")
+                return self.merge_audio_video(video_path, audio_path, output_path, "libx264")
+            return False
+    
+    def generate_audio_and_merge(self, script, video_path, audio_path, output_path,
+                                 video_encoder="copy"):
+        """Stream TTS audio straight into ffmpeg, saving a copy to audio_path"""
+        print(f"\n🎙️ Generating audio and merging with video...")
+        print(f"  Voice ID: {self.voice_id}")
+        print(f"  Text length: {len(script)} characters")
+        print(f"  Video: {video_path}")
+        
+        if not self._ffmpeg_available():
+            return False
+        
+        # Same mux as merge_audio_video, with the audio read from stdin
+        cmd = [
+            "ffmpeg",
+            "-loglevel", "error",  # Keep stderr small while we feed stdin
+            "-i", video_path,
+            "-f", "mp3", "-i", "pipe:0",
+            *video_codec_args(video_encoder),
+            "-map", "0:v:0",
+            "-map", "1:a:0",
+            "-shortest",
+            "-y",
+            output_path
+        ]
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        
+        piping = True
+        try:
+            with open(audio_path, 'wb', buffering=AUDIO_WRITE_BUFFER) as f:
+                for chunk in self._synthesize_segments(script):
+                    f.write(chunk)
+                    if piping:
+                        try:
+                            proc.stdin.write(chunk)
+                        except BrokenPipeError:
+                            # ffmpeg exited early (reported below); keep saving
+                            # the audio so the merge can be retried from the file
+                            piping = False
+        except Exception as e:
+            proc.kill()
+            proc.wait()
+            print(f"✗ Audio generation failed: {e}")
+            return False
+        
+        _, stderr = proc.communicate()
+        if proc.returncode != 0:
+            print(f"✗ ffmpeg failed: {stderr.decode(errors='replace')}")
+            if _can_fall_back(video_encoder):
+                print(f"✓ Audio generated: {audio_path}")
+                print("  Retrying merge with libx264")
+                return self.merge_audio_video(video_path, audio_path, output_path, "libx264")
             return False
+        
+        print(f"✓ Audio generated: {audio_path}")
+        print(f"✓ Video with voiceover: {output_path}")
+        return True
     
-    def generate_voiceover_for_video(self, script_path, video_path, output_dir="voiceover_output"):
+    def generate_voiceover_for_video(self, script_path, video_path, output_dir="voiceover_output",
+                                     video_encoder="copy"):
         """Complete pipeline: generate script, audio, and merge with video"""
         output_dir = Path(output_dir)
         output_dir.mkdir(exist_ok=True)
@@ -171,15 +410,12 @@ Generate a complete narration script that flows naturally from start to finish.
         script = self.generate_narration_script(manim_code)
         self.save_script(script, script_file)
         
-        # Step 3: Generate audio
-        print("\n🎵 Step 3: Generating audio...")
-        audio_success = self.generate_audio(script, audio_file)
-        if not audio_success:
-            return None
-        
-        # Step 4: Merge with video
-        print("\n🎬 Step 4: Merging audio with video...")
-        merge_success = self.merge_audio_video(video_path, audio_file, final_video)
+        # Step 3: Generate audio, muxing it into the video as it arrives
+        print("\n🎵 Step 3: Generating audio and merging with video...")
+        merge_success = self.generate_audio_and_merge(
+            script, str(video_path), str(audio_file), str(final_video),
+            video_encoder=video_encoder
+        )
         if not merge_success:
             return None
         
@@ -208,18 +444,23 @@ def main():
     parser.add_argument("--video", required=True, help="Path to rendered video (.mp4)")
     parser.add_argument("--output", default="voiceover_output", help="Output directory")
     parser.add_argument("--voice", default="JBFqnCBsd6RMkjVDRZzb", help="ElevenLabs voice ID")
+    parser.add_argument("--tts-concurrency", type=int, default=TTS_CONCURRENCY,
+                        help="Most ElevenLabs requests at once (default: $ELEVENLABS_CONCURRENCY or 3)")
+    parser.add_argument("--video-encoder", default="copy",
+                        help="Video codec for the merge: copy (default), auto (hardware if available) or an ffmpeg encoder name")
     
     args = parser.parse_args()
     
     # Initialize generator
-    generator = VoiceoverGenerator()
+    generator = VoiceoverGenerator(tts_concurrency=args.tts_concurrency)
     generator.set_voice(args.voice)
     
     # Generate voiceover
     final_video = generator.generate_voiceover_for_video(
         script_path=args.script,
         video_path=args.video,
-        output_dir=args.output
+        output_dir=args.output,
+        video_encoder=args.video_encoder
     )
     
     if final_video:
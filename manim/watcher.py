@@ -1,69 +1,212 @@
-import time
+import os
+import queue
+import threading
 import subprocess
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import re
+from collections import deque
+
+import redis
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
 
 SCRIPTS_DIR = Path("/shared/scripts")
 VIDEOS_DIR = Path("/shared/videos")
+SCRIPT_SUFFIX = ".py"  # what the queueHandler worker writes
+SCENE_RE = re.compile(r'class\s+(\w+)\s*\(\s*Scene\s*\)')
+PLAY_RE = re.compile(r'\.play\(')
+ANIMATION_DONE_RE = re.compile(r'Animation (\d+)\s*:')  # manim's per-animation INFO line
+
+# Renders that run longer than this are killed
+RENDER_TIMEOUT = int(os.getenv("MANIM_RENDER_TIMEOUT", "600"))
+# Manim output kept for the failure message
+RENDER_LOG_TAIL = 40
+
+# Job hashes served by /api/queue-status (same layout as queueHandler/src/db.py)
+jobs = redis.Redis.from_url(os.getenv("JOBS_REDIS_URL", "redis://redis:6379/2"), decode_responses=True)
+
+# Renders running at once, never more than there are cores
+MAX_CONCURRENT = max(1, min(int(os.getenv("MANIM_CONCURRENCY", "4")), os.cpu_count() or 1))
+# Threads each render may use, so MAX_CONCURRENT * RENDER_THREADS <= cores
+RENDER_THREADS = max(1, (os.cpu_count() or 1) // MAX_CONCURRENT)
+RENDER_ENV = {
+    **os.environ,
+    "OMP_NUM_THREADS": str(RENDER_THREADS),
+    "OPENBLAS_NUM_THREADS": str(RENDER_THREADS),
+    "MKL_NUM_THREADS": str(RENDER_THREADS),
+}
 
 SCRIPTS_DIR.mkdir(parents=True, exist_ok=True)
 VIDEOS_DIR.mkdir(parents=True, exist_ok=True)
 
-print("🎬 Manim watcher started — waiting for scripts...")
-print(f"   Watching: {SCRIPTS_DIR}")
-print(f"   Output: {VIDEOS_DIR}")
-
-while True:
-    for script_file in SCRIPTS_DIR.glob("*.txt"):
-        job_id = script_file.stem
-        output_file = VIDEOS_DIR / f"{job_id}.mp4"
-        prompt = script_file.read_text()
-
-        if not output_file.exists():
-            print(f"🌀 Rendering {script_file.name} ...")
-            try:
-                # Extract scene name from code
-                code = script_file.read_text()
-                scene_match = re.search(r'class\s+(\w+)\s*\(\s*Scene\s*\)', code)
-                scene_name = scene_match.group(1) if scene_match else None
-                
-                if not scene_name:
-                    print(f"❌ No Scene class found in {script_file}")
-                    script_file.unlink(missing_ok=True)
-                    continue
-                
-                print(f"   Scene: {scene_name}")
-                
-                # Render with Manim (without preview to avoid xdg-open error)
-                result = subprocess.run(
-                    ["manim", "-ql", str(script_file), scene_name, "-o", f"{job_id}.mp4", "--disable_caching"],
-                    capture_output=True,
-                    text=True
-                )
-                
-                if result.returncode != 0:
-                    print(f"❌ Manim render failed: {result.stderr}")
-                    script_file.unlink(missing_ok=True)
+
+class ScriptEventHandler(FileSystemEventHandler):
+    """Queues scripts as soon as the worker finishes writing them."""
+
+    def __init__(self, pending: "queue.Queue[Path]"):
+        super().__init__()
+        self.pending = pending
+
+    def _enqueue(self, path: str):
+        path = Path(path)
+        if path.suffix == SCRIPT_SUFFIX:
+            self.pending.put(path)
+
+    def on_closed(self, event):
+        # IN_CLOSE_WRITE: the file is fully written
+        if not event.is_directory:
+            self._enqueue(event.src_path)
+
+    def on_moved(self, event):
+        # Scripts written to a temp name and renamed into place
+        if not event.is_directory:
+            self._enqueue(event.dest_path)
+
+
+def update_job(job_id: str, **fields):
+    """Update the job's state, ignoring Redis outages (rendering doesn't depend on it)"""
+    try:
+        jobs.hset(f"job:{job_id}", mapping=fields)
+    except redis.RedisError as e:
+        print(f"⚠️ Could not update job {job_id}: {e}")
+
+
+def fail_job(job_id: str, message: str):
+    update_job(job_id, status="failed", message=message)
+
+
+def render_script(script_file: Path):
+    job_id = script_file.stem
+    output_file = VIDEOS_DIR / f"{job_id}.mp4"
+
+    # Duplicate events for an already-handled script
+    if not script_file.exists() or output_file.exists():
+        return
+
+    print(f"🌀 Rendering {script_file.name} ...")
+    try:
+        # Extract scene name from code
+        code = script_file.read_text()
+        scene_match = SCENE_RE.search(code)
+        scene_name = scene_match.group(1) if scene_match else None
+
+        if not scene_name:
+            print(f"❌ No Scene class found in {script_file}")
+            fail_job(job_id, "No Scene class found in generated script")
+            script_file.unlink(missing_ok=True)
+            return
+
+        print(f"   Scene: {scene_name}")
+
+        # Render with Manim (without preview to avoid xdg-open error), streaming its
+        # output line by line instead of buffering the whole log
+        proc = subprocess.Popen(
+            ["manim", "-ql", str(script_file), scene_name, "-o", f"{job_id}.mp4",
+             "--disable_caching", "--progress_bar", "none"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            env=RENDER_ENV
+        )
+        timer = threading.Timer(RENDER_TIMEOUT, proc.kill)
+        timer.start()
+
+        # Rough animation count so progress moves from 50 (script ready) towards 95
+        expected = max(1, len(PLAY_RE.findall(code)))
+        tail = deque(maxlen=RENDER_LOG_TAIL)
+        try:
+            with proc.stdout:
+                for line in proc.stdout:
+                    tail.append(line)
+                    match = ANIMATION_DONE_RE.search(line)
+                    if match:
+                        done = min(int(match.group(1)) + 1, expected)
+                        update_job(job_id, status="rendering", progress=50 + 45 * done // expected,
+                                   message=f"Rendered animation {done}/{expected}")
+            returncode = proc.wait()
+            timed_out = returncode != 0 and not timer.is_alive()
+        finally:
+            timer.cancel()
+            if proc.poll() is None:
+                proc.kill()
+
+        if returncode != 0:
+            reason = f"timed out after {RENDER_TIMEOUT}s" if timed_out else "failed"
+            print(f"❌ Manim render {reason}:\n{''.join(tail)}")
+            last_line = next((line.strip() for line in reversed(tail) if line.strip()), "")
+            fail_job(job_id, f"Manim render {reason}: {last_line}".rstrip(": "))
+            script_file.unlink(missing_ok=True)
+            return
+
+        # Find and move rendered video
+        media_dir = Path("/manim/media/videos")
+        rendered_videos = list(media_dir.glob(f"**/{job_id}.mp4"))
+
+        if rendered_videos:
+            # Move next to the destination first so the final rename is atomic
+            # and the API sees either the whole video or nothing
+            tmp_file = output_file.with_suffix(".mp4.tmp")
+            shutil.move(str(rendered_videos[0]), str(tmp_file))
+            os.replace(tmp_file, output_file)
+            print(f"✅ Finished {job_id}, saved to {output_file}")
+            update_job(job_id, status="completed", progress=100, message="Video ready",
+                       video_path=str(output_file))
+        else:
+            print(f"⚠️ Video rendered but not found")
+            fail_job(job_id, "Video rendered but not found")
+
+        script_file.unlink(missing_ok=True)  # remove after rendering
+
+    except Exception as e:
+        print(f"❌ Error processing {script_file}: {e}")
+        fail_job(job_id, str(e))
+        script_file.unlink(missing_ok=True)
+
+
+def main():
+    pending: "queue.Queue[Path]" = queue.Queue()
+
+    observer = Observer()
+    observer.schedule(ScriptEventHandler(pending), str(SCRIPTS_DIR), recursive=False)
+    observer.start()
+
+    print("🎬 Manim watcher started — waiting for scripts...")
+    print(f"   Watching: {SCRIPTS_DIR}")
+    print(f"   Output: {VIDEOS_DIR}")
+
+    # Scripts that arrived while the watcher was down
+    for script_file in SCRIPTS_DIR.glob(f"*{SCRIPT_SUFFIX}"):
+        pending.put(script_file)
+
+    # Each render is a manim subprocess, so threads are enough to run them in parallel
+    executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT)
+    in_flight = set()
+    lock = threading.Lock()
+
+    def finished(script_file: Path):
+        with lock:
+            in_flight.discard(script_file)
+
+    print(f"   Concurrent renders: {MAX_CONCURRENT} ({RENDER_THREADS} threads each)")
+
+    try:
+        while True:
+            script_file = pending.get()
+            with lock:
+                # Duplicate event for a script that is already rendering
+                if script_file in in_flight:
                     continue
-                
-                # Find and move rendered video
-                media_dir = Path("/manim/media/videos")
-                rendered_videos = list(media_dir.glob(f"**/{job_id}.mp4"))
-                
-                if rendered_videos:
-                    shutil.move(str(rendered_videos[0]), str(output_file))
-                    print(f"✅ Finished {job_id}, saved to {output_file}")
-                else:
-                    print(f"⚠️ Video rendered but not found")
-                
-                script_file.unlink(missing_ok=True)  # remove after rendering
-                
-            except subprocess.CalledProcessError as e:
-                print(f"❌ Rendering failed for {script_file}: {e}")
-                script_file.unlink(missing_ok=True)
-            except Exception as e:
-                print(f"❌ Error processing {script_file}: {e}")
-                script_file.unlink(missing_ok=True)
-
-    time.sleep(2)
+                in_flight.add(script_file)
+            future = executor.submit(render_script, script_file)
+            future.add_done_callback(lambda _, path=script_file: finished(path))
+    finally:
+        observer.stop()
+        observer.join()
+        executor.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import hashlib
+import os
+from typing import List, Optional
+
+import redis
+
+# Separate DB from the Celery broker (0) and result backend (1)
+GEMINI_CACHE_URL = os.getenv("GEMINI_CACHE_URL", "redis://redis:6379/2")
+GEMINI_CACHE_TTL = 86400 * 7
+
+_client = redis.Redis.from_url(GEMINI_CACHE_URL)
+
+
+def make_key(*parts: str) -> str:
+    """Build a cache key from everything that determines the model's output"""
+    digest = hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+    return f"gemini:{digest}"
+
+
+def get_many(keys: List[str]) -> List[Optional[str]]:
+    """Cached text for each key, None where missing or if Redis is unreachable"""
+    try:
+        values = _client.mget(keys)
+    except redis.RedisError as e:
+        print(f"Gemini cache unavailable ({e})")
+        return [None] * len(keys)
+    return [v.decode("utf-8") if v is not None else None for v in values]
+
+
+def put(key: str, text: str):
+    """Store text under key"""
+    try:
+        _client.setex(key, GEMINI_CACHE_TTL, text)
+    except redis.RedisError as e:
+        print(f"Could not store Gemini response in cache: {e}")
+
+
+def get_or_call(key: str, fn) -> str:
+    """Return the cached text for key, or call fn() and cache its result"""
+    try:
+        cached = _client.get(key)
+    except redis.RedisError as e:
+        print(f"Gemini cache unavailable ({e}), calling model")
+        return fn()
+
+    if cached is not None:
+        print(f"Gemini cache HIT {key}")
+        return cached.decode("utf-8")
+
+    print(f"Gemini cache MISS {key}")
+    text = fn()
+    put(key, text)
+    return text
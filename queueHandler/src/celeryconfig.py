@@ -1,3 +1,5 @@
+import os
+
 from celery import Celery
 
 celery_app = Celery(
@@ -8,4 +10,6 @@ celery_app = Celery(
 celery_app.conf.update(
     task_track_started=True,
     result_expires=3600,
+    # Each task ends in a Manim render, so never run more than there are cores
+    worker_concurrency=int(os.getenv("CELERY_WORKER_CONCURRENCY", min(4, os.cpu_count() or 1))),
 )
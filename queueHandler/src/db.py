@@ -0,0 +1,82 @@
+import hashlib
+import os
+from typing import Dict, Optional, Tuple
+
+import redis
+
+# Job state lives in Redis so it survives restarts and is shared by the API and workers
+JOBS_REDIS_URL = os.getenv("JOBS_REDIS_URL", "redis://redis:6379/2")
+JOB_TTL = 86400
+
+# Jobs still on their way to a video, which a duplicate prompt can join
+IN_FLIGHT_STATUSES = {"queued", "processing", "retrying", "rendering"}
+
+_client = redis.Redis.from_url(JOBS_REDIS_URL, decode_responses=True)
+
+
+def _key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def set_job(job_id: str, **fields):
+    """Create or update a job's fields and refresh its expiry"""
+    pipe = _client.pipeline()
+    pipe.hset(_key(job_id), mapping=fields)
+    pipe.expire(_key(job_id), JOB_TTL)
+    pipe.execute()
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    """Return a job's fields, or None if it doesn't exist"""
+    job = _client.hgetall(_key(job_id))
+    if not job:
+        return None
+    job["progress"] = int(job.get("progress", 0))
+    return job
+
+
+def _prompt_key(prompt: str) -> str:
+    return "prompt:" + hashlib.sha256(prompt.strip().encode("utf-8")).hexdigest()
+
+
+def delete_job(job_id: str):
+    """Remove a job's fields"""
+    _client.delete(_key(job_id))
+
+
+def _joinable(job: Dict) -> bool:
+    # Decided from the hash alone: the API container doesn't mount /shared
+    status = job.get("status")
+    if status in IN_FLIGHT_STATUSES:
+        return True
+    return status == "completed" and bool(job.get("video_path"))
+
+
+def claim_prompt(prompt: str, job_id: str) -> Optional[Tuple[str, Dict]]:
+    """Register job_id as the job for prompt, or return (job_id, job) of a joinable job with the same prompt
+
+    Jobs are shared across callers: the key is the prompt alone, so a joined
+    job keeps the submitter fields (id, prompt) of whoever created it.
+
+    job_id's hash must already exist (set_job first), so a duplicate that reads
+    the prompt key always finds the job it points to.
+    """
+    key = _prompt_key(prompt)
+    while True:
+        with _client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                existing_id = pipe.get(key)
+                if existing_id:
+                    job = get_job(existing_id)
+                    if job and _joinable(job):
+                        return existing_id, job
+
+                # Unclaimed, or the previous job failed, expired or lost its video
+                pipe.multi()
+                pipe.set(key, job_id, ex=JOB_TTL)
+                pipe.execute()
+                return None
+            except redis.WatchError:
+                # Another request claimed the prompt meanwhile; look again
+                continue
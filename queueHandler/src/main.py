@@ -5,7 +5,10 @@ from pydantic import BaseModel
 from typing import List
 from uuid import uuid4
 from src.worker import process_prompt
+from src.prompt_queue import push_pending
+from src.db import claim_prompt, delete_job, get_job, set_job
 from pathlib import Path
+import os
 
 app = FastAPI(title="Eidolon Queue Handler")
 
@@ -19,9 +22,6 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
-# In-memory "database" for demo
-jobs = {}
-
 class GenerateRequest(BaseModel):
     prompt: str
 
@@ -33,32 +33,53 @@ def root():
 def generate(id:str = Form(...), prompt: str = Form(...), files: List[UploadFile] = File(default=[])):
     print("Received generate request:", prompt)
     job_id = str(uuid4())
-    jobs[job_id] = {
-        "status": "queued",
-        "progress": 0,
-        "message": "Added to queue",
-        "prompt": prompt, 
-        "id": id
-    }
+    set_job(
+        job_id,
+        status="queued",
+        progress=0,
+        message="Added to queue",
+        prompt=prompt,
+        id=id
+    )
+
+    # Identical prompt already in flight or done: share that job, whoever submitted it
+    # (claimed after set_job so duplicates never find a prompt without its job)
+    existing = claim_prompt(prompt, job_id)
+    if existing:
+        existing_id, job = existing
+        delete_job(job_id)
+        print(f"Prompt matches job {existing_id}, not enqueuing a duplicate")
+        return {"video_id": existing_id, "status": job["status"], "message": job.get("message", ""), "deduped": True}
 
     # TODO: Handle file uploads if needed
     # For now, just process the prompt
     
-    # Enqueue Celery task
+    # Enqueue Celery task (the pending entry lets a busy worker batch it)
+    push_pending(job_id, prompt)
     process_prompt.delay(job_id, prompt)
 
     return {"video_id": job_id, "status": "queued", "message": "Video generation started"}
 
 @app.get("/api/queue-status/{job_id}")
 def status(job_id: str):
-    if job_id in jobs:
-        return jobs[job_id]
+    job = get_job(job_id)
+    if job:
+        return job
     return {"error": "Job not found"}
 
 @app.get("/api/video/{job_id}")
 def get_video(job_id: str):
     video_path = Path(f"/shared/videos/{job_id}.mp4")
-    if video_path.exists():
-        return FileResponse(video_path, media_type="video/mp4", filename=f"eidolon_{job_id}.mp4")
-    return {"error": "Video not found"}
+    try:
+        # One stat serves both the existence check and the response headers
+        stat_result = os.stat(video_path)
+    except FileNotFoundError:
+        return {"error": "Video not found"}
+    return FileResponse(
+        video_path,
+        media_type="video/mp4",
+        filename=f"eidolon_{job_id}.mp4",
+        stat_result=stat_result,
+        headers={"Accept-Ranges": "bytes"}
+    )
 
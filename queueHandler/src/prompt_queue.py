@@ -0,0 +1,34 @@
+import json
+import os
+from typing import List, Tuple
+
+import redis
+
+# Prompts waiting for code generation, so one task can batch several jobs
+PENDING_PROMPTS_KEY = "pending_prompts"
+PROMPT_QUEUE_URL = os.getenv("PROMPT_QUEUE_URL", "redis://redis:6379/2")
+
+_client = redis.Redis.from_url(PROMPT_QUEUE_URL)
+
+
+def _encode(job_id: str, prompt: str) -> str:
+    return json.dumps([job_id, prompt])
+
+
+def push_pending(job_id: str, prompt: str):
+    """Record a job as waiting for code generation"""
+    _client.rpush(PENDING_PROMPTS_KEY, _encode(job_id, prompt))
+
+
+def claim(job_id: str, prompt: str) -> bool:
+    """Take this job off the pending list; False if another task's batch already took it"""
+    return _client.lrem(PENDING_PROMPTS_KEY, 1, _encode(job_id, prompt)) == 1
+
+
+def take_pending(limit: int) -> List[Tuple[str, str]]:
+    """Atomically pop up to limit waiting jobs as (job_id, prompt) pairs"""
+    pipe = _client.pipeline()
+    pipe.lrange(PENDING_PROMPTS_KEY, 0, limit - 1)
+    pipe.ltrim(PENDING_PROMPTS_KEY, limit, -1)
+    entries, _ = pipe.execute()
+    return [tuple(json.loads(entry)) for entry in entries]
@@ -1,8 +1,16 @@
+from celery.signals import worker_process_init
 from src.celeryconfig import celery_app
+from src.cache import get_many, get_or_call, make_key, put
+from src.prompt_queue import claim, push_pending, take_pending
+from src.db import set_job
+import asyncio
+import json
+import re
 import time
+from datetime import timedelta
 from pathlib import Path
+from typing import List, Tuple
 import os
-import google.generativeai as genai
 
 SCRIPTS_DIR = Path("/shared/scripts")
 VIDEOS_DIR = Path("/shared/videos")
@@ -11,25 +19,67 @@ VIDEOS_DIR.mkdir(parents=True, exist_ok=True)
 
 # Initialize Gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    gemini_model = genai.GenerativeModel("gemini-2.0-flash-exp")
-else:
-    gemini_model = None
+GEMINI_MODEL = "gemini-2.0-flash-exp"
+# How long the system prompt stays in Gemini's context cache
+SYSTEM_PROMPT_CACHE_TTL = timedelta(hours=1)
+gemini_model = None
+_gemini_pid = None
+_system_prompt_cached_until = 0.0  # monotonic deadline of the context cache, 0 when not cached
 
-def generate_manim_code(prompt: str) -> str:
-    """Generate Manim code from prompt using Gemini"""
-    if not gemini_model:
-        return f"""from manim import *
+def get_gemini_model():
+    """Gemini model for this process, created once so every task reuses its gRPC channel"""
+    global gemini_model, _gemini_pid, _system_prompt_cached_until
+    if not GEMINI_API_KEY:
+        return None
+    # gRPC channels don't survive fork, so each pool process opens its own
+    cache_expired = _system_prompt_cached_until and time.monotonic() >= _system_prompt_cached_until
+    if gemini_model is None or _gemini_pid != os.getpid() or cache_expired:
+        # Imported here: grpc/protobuf are heavy and the API process never calls Gemini
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY, transport="grpc")
+        gemini_model = _cached_system_prompt_model()
+        if gemini_model is not None:
+            # Renew a minute early so no call lands on an expired cache
+            _system_prompt_cached_until = time.monotonic() + SYSTEM_PROMPT_CACHE_TTL.total_seconds() - 60
+        else:
+            gemini_model = genai.GenerativeModel(GEMINI_MODEL)
+            _system_prompt_cached_until = 0.0
+        _gemini_pid = os.getpid()
+        print(f"Gemini client ready in process {_gemini_pid} (model {id(gemini_model):#x})")
+    return gemini_model
 
-class DemoScene(Scene):
-    def construct(self):
-        text = Text("No Gemini API key configured")
-        self.play(Write(text))
-        self.wait(2)
-"""
-    
-    system_prompt = """You are an expert Manim developer. Generate clean, working Manim code for educational animations.
+def _cached_system_prompt_model():
+    """Model with SYSTEM_PROMPT in a Gemini context cache, or None if caching isn't available"""
+    import google.generativeai as genai
+    from google.generativeai import caching
+    try:
+        cached = caching.CachedContent.create(
+            model=f"models/{GEMINI_MODEL}",
+            system_instruction=SYSTEM_PROMPT,
+            ttl=SYSTEM_PROMPT_CACHE_TTL
+        )
+    except Exception as e:
+        print(f"Context caching unavailable ({e}), sending system prompt with each request")
+        return None
+    return genai.GenerativeModel.from_cached_content(cached_content=cached)
+
+def with_system_prompt(text: str) -> str:
+    """Prefix SYSTEM_PROMPT unless the model already has it cached"""
+    return text if _system_prompt_cached_until else f"{SYSTEM_PROMPT}\n\n{text}"
+
+@worker_process_init.connect
+def _init_worker_process(**_):
+    get_gemini_model()
+
+# Most queued jobs whose code is generated in a single Gemini call
+BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", "8"))
+
+# First complete markdown code block in a reply, ignoring any prose around it
+FENCE_RE = re.compile(r'```(?:python|py)?[ \t]*\n?(.*?)```', re.DOTALL)
+# Opening fence of a reply truncated before its closing fence
+OPEN_FENCE_RE = re.compile(r'```(?:python|py)?[ \t]*\n?(.*)', re.DOTALL)
+
+SYSTEM_PROMPT = """You are an expert Manim developer. Generate clean, working Manim code for educational animations.
 
 REQUIREMENTS:
 1. Create a Scene class that inherits from Scene
@@ -61,38 +111,162 @@ IMPORTANT:
 - Use standard Manim community API
 
 Return ONLY the Python code, no explanations."""
+
+def generate_manim_code(prompt: str) -> str:
+    """Generate Manim code from prompt using Gemini"""
+    gemini_model = get_gemini_model()
+    if not gemini_model:
+        return f"""from manim import *
+
+class DemoScene(Scene):
+    def construct(self):
+        text = Text("No Gemini API key configured")
+        self.play(Write(text))
+        self.wait(2)
+"""
+    
+    full_prompt = with_system_prompt(f"USER PROMPT: {prompt}\n\nGenerate complete Manim code:")
     
-    full_prompt = f"{system_prompt}\n\nUSER PROMPT: {prompt}\n\nGenerate complete Manim code:"
+    # Identical prompts (retries, resubmits) reuse the earlier generation
+    cache_key = make_key(GEMINI_MODEL, SYSTEM_PROMPT, prompt.strip())
+    code = get_or_call(
+        cache_key,
+        lambda: gemini_model.generate_content(full_prompt).text
+    )
     
-    response = gemini_model.generate_content(full_prompt)
-    code = response.text.strip()
+    return strip_code_fences(code)
+
+def strip_code_fences(code: str) -> str:
+    """Clean up markdown code blocks around generated code"""
+    m = FENCE_RE.search(code) or OPEN_FENCE_RE.search(code)
+    return (m.group(1) if m else code).strip()
+
+def generate_manim_code_batch(prompts: List[str]) -> List[str]:
+    """Generate Manim code for several prompts with one Gemini call"""
+    gemini_model = get_gemini_model()
+    if not gemini_model or len(prompts) < 2:
+        return [generate_manim_code(prompt) for prompt in prompts]
+    
+    keys = [make_key(GEMINI_MODEL, SYSTEM_PROMPT, prompt.strip()) for prompt in prompts]
+    codes = get_many(keys)
+    missing = [i for i, code in enumerate(codes) if code is None]
+    print(f"Gemini cache: {len(prompts) - len(missing)} HIT, {len(missing)} MISS in batch")
     
-    # Clean up markdown code blocks
-    if code.startswith("```python"):
-        code = code[9:]
-    if code.startswith("```"):
-        code = code[3:]
-    if code.endswith("```"):
-        code = code[:-3]
+    if len(missing) == 1:
+        codes[missing[0]] = generate_manim_code(prompts[missing[0]])
+    elif missing:
+        numbered = "\n".join(
+            f"USER PROMPT {n}: {prompts[i]}" for n, i in enumerate(missing, 1)
+        )
+        batch_prompt = with_system_prompt(
+            f"Generate {len(missing)} independent Manim scripts, one for each numbered USER PROMPT below. "
+            f"Respond with a JSON array of exactly {len(missing)} strings, in order, "
+            f"each the complete Python code for that prompt.\n\n{numbered}"
+        )
+        response = gemini_model.generate_content(
+            batch_prompt,
+            generation_config={"response_mime_type": "application/json"}
+        )
+        try:
+            generated = json.loads(response.text)
+            if not (isinstance(generated, list) and len(generated) == len(missing)
+                    and all(isinstance(c, str) for c in generated)):
+                raise ValueError(f"expected a JSON array of {len(missing)} strings")
+        except (ValueError, TypeError) as e:
+            # Malformed batch answer: generate each prompt on its own
+            print(f"Batch response unusable ({e}), falling back to single prompts")
+            generated = [generate_manim_code(prompts[i]) for i in missing]
+        
+        for i, code in zip(missing, generated):
+            codes[i] = code
+            put(keys[i], code)
     
-    return code.strip()
+    return [strip_code_fences(code) for code in codes]
+
+def write_script(script_path: Path, code: str):
+    """Write a script atomically so the watcher never sees a partial file"""
+    tmp_path = script_path.with_suffix(".py.tmp")  # not .py, so the watcher ignores it
+    tmp_path.write_text(code)
+    os.replace(tmp_path, script_path)
+
+async def _generate_batch(batch: List[Tuple[str, str]]) -> List[str]:
+    """Generate code for a batch while its jobs are marked as processing"""
+    marking = asyncio.gather(*(
+        asyncio.to_thread(set_job, job_id, status="processing", progress=10, message="Generating Manim code")
+        for job_id, _ in batch
+    ))
+    generating = asyncio.to_thread(generate_manim_code_batch, [p for _, p in batch])
+    _, codes = await asyncio.gather(marking, generating)
+    return codes
+
+async def _save_script(job_id: str, manim_code: str):
+    """Save one Manim script for the renderer to pick up and update its job"""
+    print(f"Generated code for {job_id}")
+    script_path = SCRIPTS_DIR / f"{job_id}.py"
+    # State first: once the script exists the watcher owns the job's status,
+    # and a later "rendering" write would clobber its completed/failed result
+    await asyncio.to_thread(
+        set_job, job_id, status="rendering", progress=50, message="Script generated, rendering video",
+        video_path=str(VIDEOS_DIR / f"{job_id}.mp4")
+    )
+    await asyncio.to_thread(write_script, script_path, manim_code)
+    print(f"Saved script to {script_path}")
+
+async def _save_scripts(job_ids: List[str], codes: List[str]) -> List[str]:
+    """Save every script in a batch, jobs concurrently; returns the jobs that failed"""
+    results = await asyncio.gather(
+        *(_save_script(j, c) for j, c in zip(job_ids, codes)),
+        return_exceptions=True
+    )
+    failed = []
+    for job_id, result in zip(job_ids, results):
+        if isinstance(result, Exception):
+            print(f"Could not save script for {job_id}: {result}")
+            failed.append(job_id)
+    return failed
+
+def _requeue(jobs: List[Tuple[str, str]]):
+    """Hand batched jobs back so their own tasks generate them"""
+    for job_id, prompt in jobs:
+        push_pending(job_id, prompt)
+        process_prompt.delay(job_id, prompt)
 
 @celery_app.task(bind=True, max_retries=3)
 def process_prompt(self, job_id: str, prompt: str):
     try:
+        result_path = f"/shared/videos/{job_id}.mp4"
+        
+        # First attempt: another task may already have generated this job in its batch
+        # (retries skip this, the job was claimed on the first attempt)
+        if not self.request.retries and not claim(job_id, prompt):
+            print(f"Job {job_id} was generated in another task's batch")
+            return {"status": "completed", "video_path": result_path}
+        
         print(f"Processing job {job_id}: {prompt}")
         
+        # Take other queued jobs along so they share one Gemini call
+        batch = [(job_id, prompt)] + take_pending(BATCH_SIZE - 1)
+        if len(batch) > 1:
+            print(f"Batching {len(batch)} jobs into one Gemini call")
+        
         # Generate Manim code with Gemini
-        manim_code = generate_manim_code(prompt)
-        print(f"Generated code for {job_id}")
-
-        # Save the Manim script for the renderer to pick up
-        script_path = SCRIPTS_DIR / f"{job_id}.py"
-        script_path.write_text(manim_code)
-        print(f"Saved script to {script_path}")
-
-        result_path = f"/shared/videos/{job_id}.mp4"
+        try:
+            codes = asyncio.run(_generate_batch(batch))
+        except Exception:
+            _requeue(batch[1:])
+            raise
+        
+        failed = asyncio.run(_save_scripts([j for j, _ in batch], codes))
+        # Other jobs go back to the queue; this task's own job is retried below
+        _requeue([(j, p) for j, p in batch[1:] if j in failed])
+        if job_id in failed:
+            raise RuntimeError(f"Could not save script for {job_id}")
+        
         return {"status": "completed", "video_path": result_path}
     except Exception as e:
         print(f"Error processing {job_id}: {e}")
+        if self.request.retries >= self.max_retries:
+            set_job(job_id, status="failed", message=str(e))
+        else:
+            set_job(job_id, status="retrying", message=f"Retrying after error: {e}")
         self.retry(exc=e, countdown=10)